@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
 import argparse
+import os
 import sys
 
 from .auth import login, logout
+from .blob import gc
+from .iface import get_client
+from .sets import Settings
+from .sync import sync
+from .transfer import HTTPTransfer, find, resume
 
 
 def main():
@@ -13,6 +19,19 @@ def main():
     p_login = subparsers.add_parser("login", help="login to mlop")
     p_login.add_argument("key", nargs="?", help="login key")
     p_logout = subparsers.add_parser("logout", help="logout from mlop")
+    p_resume = subparsers.add_parser("resume", help="resume interrupted uploads")
+    p_resume.add_argument(
+        "dir", nargs="?", default=".mlop", help="run or project directory"
+    )
+    p_sync = subparsers.add_parser("sync", help="upload runs recorded offline")
+    p_sync.add_argument("dir", nargs="+", help="run directory")
+    p_sync.add_argument(
+        "--force", action="store_true", help="upload runs that were already synced"
+    )
+    p_gc = subparsers.add_parser("gc", help="remove files no run refers to")
+    p_gc.add_argument(
+        "--dry-run", action="store_true", help="only report what would be removed"
+    )
 
     args = parser.parse_args()
 
@@ -23,6 +42,28 @@ def main():
             login()
     elif args.command == "logout":
         logout()
+    elif args.command == "resume":
+        settings = Settings()
+        paths = find(os.path.abspath(args.dir))
+        ok = sum(
+            bool(
+                resume(
+                    p, HTTPTransfer(get_client(settings, "storage"), settings), settings
+                )
+            )
+            for p in paths
+        )
+        print(f"{settings.tag}: resumed {ok}/{len(paths)} upload(s)")
+        sys.exit(0 if ok == len(paths) else 1)
+    elif args.command == "sync":
+        ok = sum(sync(d, force=args.force) for d in args.dir)
+        print(f"{Settings.tag}: synced {ok}/{len(args.dir)} run(s)")
+        sys.exit(0 if ok == len(args.dir) else 1)
+    elif args.command == "gc":
+        n, size = gc(dry_run=args.dry_run)
+        print(
+            f"{Settings.tag}: {'would remove' if args.dry_run else 'removed'} {n} file(s), {size / 2**20:.1f} MiB"
+        )
     else:
         parser.print_help()
         sys.exit(1)
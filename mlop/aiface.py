@@ -0,0 +1,360 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, List, Union
+
+import httpx
+
+from .api import (
+    make_compat_file_batch_v1,
+    make_compat_meta_v1,
+    make_compat_storage_v1,
+    make_compat_trigger_v1,
+)
+from .iface import ServerInterface, get_client_key, get_kinds, get_timeout
+from .sets import Settings
+from .transfer import find, resume
+from .util import print_url
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "AsyncInterface"
+
+LOOP = None  # one event loop thread per process
+CLIENTS = {}  # get_client_key -> httpx.AsyncClient, only used on the loop
+_lock_loop = threading.Lock()
+
+
+class AsyncServerInterface(ServerInterface):
+    """Runs all streams, uploads, metadata updates and trigger polling as tasks on one event loop"""
+
+    def __init__(self, config: dict, settings: Settings) -> None:
+        super().__init__(config=config, settings=settings)
+        self._loop = get_loop()
+        self._tasks = []  # long-running streams
+        self._pending = {}  # future -> (kind, name) of file, storage and meta tasks
+        self._trigger = None
+        self._semaphores = {}  # kind -> bound on requests in flight
+
+    def start(self) -> None:
+        logger.info(f"{tag}: find live updates at {print_url(self.settings.url_view)}")
+        for url, headers, q, name in [
+            (self.settings.url_num, self.headers_num, self._queue_num, "num"),
+            (self.settings.url_data, self.headers, self._queue_data, "data"),
+            (
+                self.settings.url_message,
+                self.headers,
+                self._queue_message,
+                "message" if self.settings.mode == "debug" else None,
+            ),
+        ]:
+            self._tasks.append(
+                self._submit(self._stream(url, headers, q, name), "stream", name)
+            )
+        self._tasks.append(self._submit(self._files(), "stream", "file"))
+        self._trigger = asyncio.run_coroutine_threadsafe(self._poll(), self._loop)
+        if self._thread_progress is None and not self.settings.disable_progress:
+            self._thread_progress = threading.Thread(
+                target=self._worker_progress, daemon=True
+            )
+            self._thread_progress.start()
+        if self.settings.x_file_stream_resume:
+            self._resume()
+
+    def _join(self) -> None:
+        self._trigger.cancel() if self._trigger else None
+        concurrent.futures.wait(self._tasks)  # streams drain, as the threads do
+        self._tasks = []
+
+        end = time.time() + self.settings.x_file_stream_join_timeout_seconds
+        while self._pending and time.time() < end:  # files schedule storage uploads
+            with self._lock_uploads:
+                pending = list(self._pending)
+            concurrent.futures.wait(pending, timeout=max(0, end - time.time()))
+        with self._lock_uploads:
+            pending = list(self._pending.items())
+        for f, _ in pending:
+            f.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for kind, names in get_kinds([e for _, e in pending]).items():
+            logger.error(
+                f"{tag}: {len(names)} {kind} still pending after {self.settings.x_file_stream_join_timeout_seconds}s: {', '.join(names[:8])}"
+            )
+        for kind, names in get_kinds(self._failed).items():
+            logger.error(f"{tag}: {len(names)} {kind} failed: {', '.join(names[:8])}")
+
+    def _update_meta(
+        self,
+        num: Union[List[str], None] = None,
+        df: Union[Dict[str, List[str]], None] = None,
+    ):
+        self._submit(self._meta(num, df), "meta", "meta")
+
+    def _resume(self) -> None:
+        for path in find(os.path.dirname(self.settings.get_dir())):
+            self._submit(self._resume_one(path), "upload", os.path.basename(path))
+
+    async def _resume_one(self, path):
+        r = await self._thread(resume, path, self._transfer, self.settings)
+        if r is None:
+            self._fail("upload", os.path.basename(path))
+
+    def _submit(self, coro, kind, name) -> concurrent.futures.Future:
+        f = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        if kind != "stream":
+            with self._lock_uploads:
+                self._pending[f] = (kind, name)
+            f.add_done_callback(self._unpend)
+        return f
+
+    def _unpend(self, f) -> None:
+        with self._lock_uploads:
+            self._pending.pop(f, None)
+
+    def _fail(self, kind, name) -> None:
+        with self._lock_uploads:
+            self._failed.append((kind, name))
+
+    async def _stream(self, url, headers, q, name=None):
+        while not (q.empty() and self._stop_event.is_set()):
+            if q.empty():
+                await asyncio.sleep(self.settings.x_internal_check_process)
+                continue
+            b = []
+            while len(b) < self.settings.x_file_stream_max_size:
+                try:
+                    b.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            s = time.time()
+            r = await self._apost_v1(url, headers, b"".join(b), name=name, n=len(b))
+            if r and name is not None:
+                logger.debug(
+                    f"{tag}: {name}: sent {len(b)} line(s) at {len(b) / (time.time() - s):.2f} lines/s to {url}"
+                )
+
+    async def _files(self):
+        q = self._queue_file
+        while not (q.empty() and self._stop_event.is_set()):
+            if q.empty():
+                await asyncio.sleep(self.settings.x_internal_check_process)
+                continue
+            b = []
+            while len(b) < self.settings.x_file_stream_max_size:
+                try:
+                    b.append(q.get_nowait())  # coalesce files of many steps
+                except queue.Empty:
+                    break
+            await self._file(b)
+
+    async def _file(self, items):
+        items = self._claim(items)
+        if not items:
+            return
+        r = await self._apost_v1(
+            self.settings.url_file,
+            self.headers,
+            make_compat_file_batch_v1(items),
+            name="file",
+        )
+        try:
+            d = make_compat_storage_v1(r.json())
+            for file, _, _ in items:
+                for k, fel in file.items():
+                    for f in fel:
+                        urls = d.get((k, f"{f._name}{f._ext}"))
+                        url = urls.popleft() if urls else None
+                        if not url:
+                            logger.critical(
+                                f"{tag}: file api did not provide storage url"
+                            )
+                            self._release([f])
+                        else:  # runs on its own, like the threaded uploads
+                            self._submit(
+                                self._storage(f, url), "upload", f"{f._name}{f._ext}"
+                            )
+        except Exception as e:
+            fs = [f for file, _, _ in items for fel in file.values() for f in fel]
+            self._release(fs)
+            for f in fs:
+                self._fail("upload", f"{f._name}{f._ext}")
+            logger.critical(
+                "%s: failed to send files to %s: [%s] %s",
+                tag,
+                self.settings.url_file,
+                type(e).__name__,
+                e,
+            )
+
+    async def _storage(self, f, url):
+        r = None
+        try:
+            if (
+                self.settings.x_file_stream_multipart
+                and os.path.getsize(f._path) > self.settings.x_file_stream_part_size
+            ):
+                r = await self._thread(self._worker_multipart, f, url)  # parts
+                if r is None:
+                    self._fail("upload", f"{f._name}{f._ext}")
+            else:
+                async with self._sem("storage"):
+                    r = await self._atry(
+                        get_client(self.settings, "storage").put,
+                        url,
+                        {
+                            "Content-Type": f._type,
+                            "Content-Length": str(os.path.getsize(f._path)),
+                        },
+                        lambda: aiter_chunks(
+                            f._path,
+                            self.settings.x_file_stream_chunk_size,
+                            self._executor,
+                        ),
+                        name="upload",
+                        item=f"{f._name}{f._ext}",
+                    )
+        finally:
+            if r is None:  # let a later log of the same content register again
+                self._release([f])
+
+    async def _meta(self, num=None, file=None):
+        if num:
+            await self._apost_v1(
+                self.settings.url_meta,
+                self.headers,
+                make_compat_meta_v1(num, "num", self.settings),
+                name="meta",
+                compress=False,
+            )
+        for k, v in (file or {}).items():
+            await self._apost_v1(
+                self.settings.url_meta,
+                self.headers,
+                make_compat_meta_v1(v, k, self.settings),
+                name="meta",
+                compress=False,
+            )
+
+    async def _poll(self):
+        while not self._stop_event.is_set():
+            try:
+                r = await self._apost_v1(
+                    self.settings.url_trigger,
+                    self.headers,
+                    make_compat_trigger_v1(self.settings),
+                    compress=False,
+                    record=False,  # polled again shortly
+                )
+                if r is not None and r.json()["status"] == "CANCELLED":
+                    logger.critical(f"{tag}: server finished run")
+                    os._exit(signal.SIGINT.value)  # TODO: do a more graceful exit
+            except Exception as e:
+                logger.critical("%s: failed: %s", tag, e)
+            await asyncio.sleep(self.settings.x_sys_sampling_interval)
+
+    async def _apost_v1(
+        self, url, headers, content, name="post", n=None, compress=True, record=True
+    ):
+        if compress and self._compress is not None:
+            content, headers = self._compress_v1(content, headers)
+        async with self._sem():
+            return await self._atry(
+                get_client(self.settings).post,
+                url,
+                headers,
+                content,
+                name,
+                n,
+                record=record,
+            )
+
+    async def _atry(
+        self, method, url, headers, content, name=None, n=None, item=None, record=True
+    ):
+        retry = 0
+        while retry < self.settings.x_file_stream_retry_max:
+            try:
+                r = await method(
+                    url,
+                    content=content() if callable(content) else content,
+                    headers=headers,
+                )
+                if r.status_code in [200, 201]:
+                    return r
+                logger.warning(
+                    f"{tag}: {name}: retry {retry + 1}/{self.settings.x_file_stream_retry_max}: response code {r.status_code} for {n or 'request'} from {url}: {r.text}"
+                )
+            except Exception as e:
+                logger.debug(
+                    "%s: %s: retry %s/%s: no response from %s: %s: %s",
+                    tag,
+                    name,
+                    retry + 1,
+                    self.settings.x_file_stream_retry_max,
+                    url,
+                    type(e).__name__,
+                    e,
+                )
+            retry += 1
+            if retry < self.settings.x_file_stream_retry_max:  # none after the last
+                await asyncio.sleep(
+                    min(
+                        self.settings.x_file_stream_retry_wait_min_seconds * (2**retry),
+                        self.settings.x_file_stream_retry_wait_max_seconds,
+                    )
+                )
+        logger.critical(f"{tag}: {name}: failed after {retry} retries")
+        if record:
+            self._fail(name or "post", item or url)
+        return None
+
+    async def _thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, fn, *args
+        )
+
+    def _sem(self, kind: str = "api") -> asyncio.Semaphore:
+        if kind not in self._semaphores:  # bind on the loop
+            self._semaphores[kind] = asyncio.Semaphore(
+                self.settings.x_file_stream_max_conn
+            )
+        return self._semaphores[kind]
+
+
+async def aiter_chunks(path, size, executor=None):
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        while True:
+            b = await loop.run_in_executor(executor, f.read, size)  # off the loop
+            if not b:
+                break
+            yield b
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global LOOP
+    with _lock_loop:
+        if LOOP is None or LOOP.is_closed():
+            LOOP = asyncio.new_event_loop()
+            threading.Thread(target=LOOP.run_forever, name=tag, daemon=True).start()
+    return LOOP
+
+
+def get_client(settings: Settings, kind: str = "api") -> httpx.AsyncClient:
+    key = get_client_key(settings, kind)
+    c = CLIENTS.get(key)
+    if c is None or c.is_closed:
+        c = CLIENTS[key] = httpx.AsyncClient(
+            http2=True,
+            verify=key[1],
+            proxy=key[2],
+            limits=httpx.Limits(
+                max_keepalive_connections=key[3], max_connections=key[3]
+            ),
+            timeout=get_timeout(key),
+        )
+    return c
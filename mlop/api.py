@@ -1,3 +1,4 @@
+import collections
 import json
 import logging
 import re
@@ -5,7 +6,7 @@ import signal
 from datetime import datetime
 
 from .data import Histogram
-from .util import clean_dict, find_node
+from .util import clean_dict, find_node, import_lib
 
 logger = logging.getLogger(f"{__name__.split('.')[0]}")
 tag = "API"
@@ -26,42 +27,57 @@ ABBR = {
 }
 
 
+def get_dumps():
+    # pick the fastest available json backend; all return compact utf-8 bytes
+    orjson = import_lib("orjson")
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        return "orjson", lambda obj: orjson.dumps(obj, option=option)
+    msgspec = import_lib("msgspec")
+    if msgspec is not None:
+        return "msgspec", msgspec.json.Encoder().encode
+    return "json", lambda obj: json.dumps(obj, separators=(",", ":")).encode()
+
+
+JSON, dumps = get_dumps()
+
+
 def make_compat_trigger_v1(settings):
-    return json.dumps(
+    return dumps(
         {
             "runId": settings._op_id,
         }
-    ).encode()
+    )
 
 
 def make_compat_start_v1(config, settings, info):
-    return json.dumps(
+    return dumps(
         {
             # "runId": settings._op_id,
             "runName": settings._op_name,
             "projectName": settings.project,
-            "config": json.dumps(config) if config is not None else None,
-            "loggerSettings": json.dumps(clean_dict(settings.to_dict())),
-            "systemMetadata": json.dumps(info) if info is not None else None,
+            "config": dumps(config).decode() if config is not None else None,
+            "loggerSettings": dumps(clean_dict(settings.to_dict())).decode(),
+            "systemMetadata": dumps(info).decode() if info is not None else None,
             "createdAt": settings.compat.get("createdAt"),
             "updatedAt": settings.compat.get("updatedAt"),
         }
-    ).encode()
+    )
 
 
 def make_compat_status_v1(settings, trace=None):
-    return json.dumps(
+    return dumps(
         {
             "runId": settings._op_id,
             "status": STATUS[settings._op_status],
-            # "metadata": json.dumps(settings.meta),
-            "statusMetadata": json.dumps(trace) if trace is not None else None,
+            # "metadata": dumps(settings.meta),
+            "statusMetadata": dumps(trace).decode() if trace is not None else None,
         }
-    ).encode()
+    )
 
 
 def make_compat_meta_v1(meta, dtype, settings):
-    return json.dumps(
+    return dumps(
         {
             "runId": settings._op_id,
             # "runName": settings._op_name,
@@ -69,7 +85,7 @@ def make_compat_meta_v1(meta, dtype, settings):
             "logType": dtype.upper() if dtype != "num" else "METRIC",
             "logName": meta,  # TODO: better aggregate
         }
-    ).encode()
+    )
 
 
 def make_compat_monitor_v1(data):
@@ -81,7 +97,7 @@ def make_compat_monitor_v1(data):
 
 def make_compat_num_v1(data, timestamp, step):
     line = [
-        json.dumps(
+        dumps(
             {
                 "time": int(timestamp * 1000),  # convert to ms
                 "step": int(step),
@@ -89,56 +105,78 @@ def make_compat_num_v1(data, timestamp, step):
             }
         )
     ]
-    return ("\n".join(line) + "\n").encode("utf-8")
+    return b"\n".join(line) + b"\n"
+
+
+def make_compat_num_batch_v1(keys, steps, values, timestamps):
+    lines = [
+        dumps(
+            {
+                "time": t,
+                "step": s,
+                "data": dict(zip(keys, v)),
+            }
+        )
+        for t, s, v in zip(
+            (timestamps * 1000).astype("int64").tolist(),  # convert to ms
+            steps.tolist(),
+            values.tolist(),
+        )
+    ]
+    return b"\n".join(lines) + b"\n"
 
 
 def make_compat_data_v1(data, timestamp, step):
     lines = []
     for k, dl in data.items():
         for d in dl:
-            c = json.dumps(d.to_dict())
-            lines.append(
-                json.dumps(
-                    {
-                        "time": int(timestamp * 1000),  # convert to ms
-                        "data": c,
-                        "dataType": type(d).__name__.upper(),
-                        "logName": k,
-                        "step": step,
-                    }
-                )
+            head = dumps(
+                {
+                    "time": int(timestamp * 1000),  # convert to ms
+                    "dataType": type(d).__name__.upper(),
+                    "logName": k,
+                    "step": step,
+                }
             )
-    return ("\n".join(lines) + "\n").encode("utf-8")
+            # the server expects data as a string: splice in the encoded object
+            # escaped as one, instead of encoding its json a second time
+            body = dumps(d.to_dict()).replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+            lines.append(head[:-1] + b',"data":"' + body + b'"}')
+    return b"\n".join(lines) + b"\n"
 
 
-def make_compat_file_v1(file, timestamp, step):
+def make_compat_file_batch_v1(items):
     batch = []
-    for k, fl in file.items():
-        for f in fl:
-            i = {
-                "fileName": f"{f._name}{f._ext}",
-                "fileSize": f._stat.st_size,
-                "fileType": f._ext[1:],
-                "time": int(f._stat.st_mtime * 1000),
-                "logName": k,
-                "step": step,
-            }
-            batch.append(i)
-    return json.dumps({"files": batch}).encode()
-
-
-def make_compat_storage_v1(f, fl):
-    # workaround for lack of file ident on server side
-    for i in fl:
-        if next(iter(i.keys())) == f"{f._name}{f._ext}":
-            return next(iter(i.values()))
-    return None
+    for file, _, step in items:
+        for k, fl in file.items():
+            for f in fl:
+                i = {
+                    "fileName": f"{f._name}{f._ext}",
+                    "fileSize": f._stat.st_size,
+                    "fileType": f._ext[1:],
+                    "time": int(f._stat.st_mtime * 1000),
+                    "logName": k,
+                    "step": step,
+                }
+                batch.append(i)
+    return dumps({"files": batch})
+
+
+def make_compat_storage_v1(d):
+    # workaround for lack of file ident on server side: index urls by log and file name,
+    # in request order as a batch may hold the same name at several steps
+    r = {}
+    for k, fl in d.items():
+        for i in fl:
+            for n, u in i.items():
+                r.setdefault((k, n), collections.deque()).append(u)
+    return r
 
 
 def make_compat_message_v1(level, message, timestamp, step):
     # TODO: server side int log level support
     line = [
-        json.dumps(
+        dumps(
             {
                 "time": int(timestamp * 1000),  # convert to ms
                 "message": message,
@@ -147,13 +185,11 @@ def make_compat_message_v1(level, message, timestamp, step):
             }
         )
     ]
-    return ("\n".join(line) + "\n").encode("utf-8")
+    return b"\n".join(line) + b"\n"
 
 
 def make_compat_graph_v1(settings, name, nodes):
-    return json.dumps(
-        {"runId": settings._op_id, "graph": {"format": name, "nodes": nodes}}
-    ).encode()
+    return dumps({"runId": settings._op_id, "graph": {"format": name, "nodes": nodes}})
 
 
 def make_compat_graph_nodes_v1(d, ref, dep=0, p="", r={}):
@@ -193,7 +229,7 @@ def make_compat_graph_nodes_v1(d, ref, dep=0, p="", r={}):
 
 
 def make_compat_alert_v1(settings, t, m, n, level, url, **kwargs):
-    return json.dumps(
+    return dumps(
         {
             "runId": settings._op_id,
             "alert": {
@@ -205,11 +241,11 @@ def make_compat_alert_v1(settings, t, m, n, level, url, **kwargs):
                 "url": kwargs.get("url", None),
             },
         }
-    ).encode()
+    )
 
 
 def make_compat_webhook_v1(timestamp, level, title, message, step, url):
-    return json.dumps(
+    return dumps(
         {
             "username": __name__.split(".")[0],
             "content": f"{level}: {title}",
@@ -240,4 +276,4 @@ def make_compat_webhook_v1(timestamp, level, title, message, step, url):
                 }
             ],
         }
-    ).encode()
+    )
@@ -1,11 +1,12 @@
 import getpass
 import logging
+import os
 import sys
 import webbrowser
 
-import httpx
 import keyring
 
+from .iface import get_client
 from .log import setup_logger, teardown_logger
 from .sets import get_console, setup
 from .util import ANSI, import_lib, print_url
@@ -18,7 +19,7 @@ def login(settings=None, retry=False):
     settings = setup(settings)
     setup_logger(settings=settings, logger=tlogger)
     try:
-        assert sys.platform == "darwin"
+        assert sys.platform == "darwin" or os.getenv("PYTHON_KEYRING_BACKEND")
         auth = keyring.get_password(f"{settings.tag}", f"{settings.tag}")
     except (keyring.errors.NoKeyringError, AssertionError):  # fallback
         keyring.set_keyring(import_lib("keyrings.alt.file").PlaintextKeyring())
@@ -33,10 +34,7 @@ def login(settings=None, retry=False):
             "%s: authentication failed: the provided token cannot be empty", tag
         )
         settings._auth = "_key"
-    client = httpx.Client(
-        verify=True if not settings.insecure_disable_ssl else False,
-        proxy=settings.http_proxy or settings.https_proxy or None,
-    )
+    client = get_client(settings)
     try:
         r = client.post(
             url=settings.url_login,
@@ -86,7 +84,7 @@ def logout(settings=None):
     settings = setup(settings)
     setup_logger(settings=settings, logger=tlogger)
     try:
-        assert sys.platform == "darwin"
+        assert sys.platform == "darwin" or os.getenv("PYTHON_KEYRING_BACKEND")
         keyring.delete_password(f"{settings.tag}", f"{settings.tag}")
     except (keyring.errors.NoKeyringError, AssertionError):
         keyring.set_keyring(import_lib("keyrings.alt.file").PlaintextKeyring())
@@ -0,0 +1,88 @@
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+from typing import Tuple
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Blob"
+
+DIR = os.path.join(os.path.expanduser("~"), f".{__name__.split('.')[0]}", "blobs")
+FICLONE = 0x40049409  # linux ioctl to share extents between files
+
+
+def put(src: str, dst: str, h: str, own: bool = False) -> str:
+    # place src at dst through the blob of its hash so runs share one copy on disk
+    blob = get_path(h)
+    try:
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if (
+            os.stat(os.path.dirname(blob)).st_dev
+            != os.stat(os.path.dirname(dst)).st_dev
+        ):
+            return link(src, dst, hard=own)  # links do not cross devices
+        if not os.path.exists(blob):
+            tmp = f"{blob}.{os.getpid()}-{threading.get_ident()}.tmp"
+            link(src, tmp, hard=own)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)  # shared inode
+            os.replace(tmp, blob)
+    except OSError as e:
+        logger.debug("%s: failed to store %s: %s", tag, blob, e)
+        return link(src, dst, hard=own)
+    return link(blob, dst)
+
+
+def link(src: str, dst: str, hard: bool = True) -> str:
+    if hard:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    try:
+        reflink(src, dst)
+        return "reflink"
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+def reflink(src: str, dst: str) -> None:
+    try:
+        import fcntl
+    except ImportError as e:
+        raise OSError(e)
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+
+
+def gc(dir: str = DIR, dry_run: bool = False) -> Tuple[int, int]:
+    # a blob is unreferenced once no run directory holds a hardlink to it
+    n, size = 0, 0
+    for root, _, files in os.walk(dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                s = os.stat(path)
+                if s.st_nlink > 1 or (
+                    name.endswith(".tmp") and time.time() - s.st_mtime < 2**12
+                ):
+                    continue
+                if not dry_run:
+                    os.remove(path)
+                n, size = n + 1, size + s.st_size
+            except OSError as e:
+                logger.debug("%s: failed to remove %s: %s", tag, path, e)
+    return n, size
+
+
+def get_path(h: str) -> str:
+    return os.path.join(DIR, h[:2], h)
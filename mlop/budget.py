@@ -0,0 +1,165 @@
+import logging
+import os
+import tempfile
+import threading
+import uuid
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Budget"
+
+POLICY = ["block", "drop", "stage"]
+
+
+class Budget:
+    """Process-wide accounting of raw media held between construction and encoding"""
+
+    def __init__(self) -> None:
+        self.max_bytes = 2**30
+        self.policy = "stage"
+        self.timeout = 2**4
+        self.dir = os.path.join(tempfile.gettempdir(), f"{__name__.split('.')[0]}")
+        self.bytes = 0
+        self.queued = 0  # admitted bytes already queued for encoding
+        self.peak = 0
+        self.staged = 0
+        self.drops = 0
+        self._cond = threading.Condition()
+        self._runs = []  # (settings, admission state) of live runs, latest last
+
+    def configure(self, settings) -> None:
+        policy = settings.x_media_budget_policy
+        if policy not in POLICY:
+            logger.warning(
+                f"{tag}: unsupported policy {policy}, expected one of {POLICY}: proceeding with stage"
+            )
+            policy = "stage"
+        state = (
+            settings.x_media_budget_bytes,
+            policy,
+            settings.x_media_budget_timeout_seconds,
+            f"{settings.get_dir()}/stage",  # staged media stays with its run
+        )
+        with self._cond:
+            self._runs.append((settings, state))
+            self._apply()
+
+    def remove(self, settings) -> None:
+        # the run finished; media built from now on is admitted for the latest live run
+        with self._cond:
+            self._runs = [e for e in self._runs if e[0] is not settings]
+            self._apply()
+
+    def admit(self, f, attr: str) -> None:
+        n = get_size(getattr(f, attr, None))
+        if not n or self.max_bytes <= 0:
+            return
+        with self._cond:
+            ok = self._fits(n)
+            if not ok and self.policy == "block":  # only encoding frees the budget
+                self._cond.wait_for(
+                    lambda: self._fits(n) or not self.queued, timeout=self.timeout
+                )
+                ok = self._fits(n)  # else held by media not yet logged: stage now
+            if ok:
+                self.bytes += n
+                self.peak = max(self.peak, self.bytes)
+                f._share = [n, False]  # bytes, queued
+                f._budget = weakref.finalize(f, self._release, f._share)  # on discard
+                return
+
+        if self.policy != "drop":  # stage, or block that timed out
+            try:
+                f._staged = (attr, stage(getattr(f, attr), self.dir))  # path kept
+                setattr(f, attr, None)
+                with self._cond:
+                    self.staged += n
+                return
+            except Exception as e:
+                logger.debug("%s: failed to stage %s: %s", tag, attr, e)
+        setattr(f, attr, None)
+        f._dropped = True
+        with self._cond:
+            self.drops += 1
+            drops = self.drops
+        if drops & (drops - 1) == 0:  # log sparsely
+            logger.warning(
+                f"{tag}: dropped {drops} media item(s) over the {self.max_bytes / 2**20:.0f} MiB budget"
+            )
+
+    def enqueue(self, f) -> None:
+        e = getattr(f, "_share", None)
+        if e is not None:
+            with self._cond:
+                if not e[1] and f._budget.alive:
+                    e[1] = True
+                    self.queued += e[0]
+
+    def stats(self):
+        with self._cond:
+            return {
+                "bytes": self.bytes,
+                "queued": self.queued,
+                "peak": self.peak,
+                "staged": self.staged,
+                "drops": self.drops,
+            }
+
+    def _apply(self) -> None:
+        if self._runs:
+            self.max_bytes, self.policy, self.timeout, self.dir = self._runs[-1][1]
+        else:  # keep the last limits for media built between runs
+            self.dir = os.path.join(tempfile.gettempdir(), f"{__name__.split('.')[0]}")
+
+    def _fits(self, n) -> bool:
+        return self.bytes == 0 or self.bytes + n <= self.max_bytes
+
+    def _release(self, e) -> None:
+        with self._cond:
+            self.bytes -= e[0]
+            self.queued -= e[0] if e[1] else 0
+            self._cond.notify_all()
+
+
+BUDGET = Budget()
+
+
+def release(f) -> None:
+    # raw data was encoded or dropped; return its share of the budget
+    r = getattr(f, "_budget", None)
+    if r is not None:
+        r()
+
+
+def unstage(f) -> None:
+    s = getattr(f, "_staged", None)
+    if s is not None:
+        attr, (path, kind) = s
+        v = np.load(path)  # read in full, so no mapping keeps the file open
+        os.remove(path)
+        if kind == "pil":
+            from PIL import Image
+
+            v = Image.fromarray(v)
+        setattr(f, attr, v)
+        f._staged = None
+
+
+def stage(v, dir):
+    os.makedirs(dir, exist_ok=True)
+    path = os.path.join(dir, f"{uuid.uuid4()}.npy")
+    kind = "pil" if hasattr(v, "getbands") else "array"
+    if hasattr(v, "detach"):
+        v = v.detach().cpu().numpy()
+    np.save(path, np.asarray(v))
+    return path, kind
+
+
+def get_size(v) -> int:
+    if hasattr(v, "nbytes"):
+        return v.nbytes
+    if hasattr(v, "size") and hasattr(v, "getbands"):  # PIL
+        return v.size[0] * v.size[1] * len(v.getbands())
+    return 0
@@ -0,0 +1,177 @@
+import logging
+import os
+import pickle
+import queue
+import struct
+import sys
+import time
+from collections import deque
+
+from .sets import Settings
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Buffer"
+
+POLICY = ["block", "drop", "sample", "spill"]
+
+
+class Buffer(queue.Queue):
+    """Queue bounded by pending items and bytes, with a policy applied when full"""
+
+    def __init__(
+        self, settings: Settings, name: str = "queue", policy: str = None
+    ) -> None:
+        super().__init__()  # bounds are enforced by put
+        self.settings = settings
+        self.name = name
+        self.max_size = settings.x_queue_max_size
+        self.max_bytes = settings.x_queue_max_bytes
+        self.policy = policy or settings.x_queue_policy
+        if self.policy not in POLICY:
+            logger.warning(
+                f"{tag}: unsupported policy {self.policy}, expected one of {POLICY}: proceeding with block"
+            )
+            self.policy = "block"
+
+        self.bytes = 0
+        self.drops = 0
+        self.spilled = 0  # items pending on disk
+        self.spill_bytes = 0
+        self._spill = None
+        self._spill_pos = 0
+
+    def put(self, item, block=True, timeout=None) -> None:
+        n, e = get_size(item), None
+        with self.not_full:
+            drops, spill = self.drops, self._spill
+            if self.policy == "spill" and (self.spilled or self._full(n)):
+                e = self._put_spill(item, n)  # keep fifo order while spilling
+            else:
+                if self._full(n):
+                    self._make_room(n, block, timeout)
+                self.queue.append((item, n))
+                self.bytes += n
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+        # log outside the lock since console output may be queued here
+        if self.drops.bit_length() != drops.bit_length():  # log sparsely
+            logger.warning(
+                f"{tag}: {self.name}: dropped {self.drops} item(s) when full"
+            )
+        if spill is None and self._spill is not None:
+            logger.debug(f"{tag}: {self.name}: spilling to {self._path()}")
+        if e is not None:
+            logger.debug("%s: %s: failed to spill: %s", tag, self.name, e)
+
+    def stats(self):
+        with self.mutex:
+            return {
+                "depth": self._qsize(),
+                "bytes": self.bytes,
+                "drops": self.drops,
+                "spill": self.spill_bytes,
+            }
+
+    def close(self) -> None:
+        with self.mutex:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+                if not self.spilled:
+                    os.remove(self._path())
+
+    def _full(self, n) -> bool:
+        return bool(self.queue) and (
+            (self.max_size > 0 and len(self.queue) >= self.max_size)
+            or (self.max_bytes > 0 and self.bytes + n > self.max_bytes)
+        )
+
+    def _make_room(self, n, block, timeout) -> None:
+        if self.policy == "drop":
+            while self._full(n):
+                self._drop(self.queue.popleft())
+        elif self.policy == "sample":  # keep every other pending item
+            keep = deque()
+            for i, e in enumerate(self.queue):
+                if i % 2:
+                    keep.append(e)
+                else:
+                    self._drop(e)
+            self.queue = keep
+            while self._full(n):
+                self._drop(self.queue.popleft())
+        else:  # block, or spill that failed to write
+            if not block:
+                raise queue.Full
+            end = None if timeout is None else time.time() + timeout
+            while self._full(n):
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Full
+                self.not_full.wait(remaining)
+
+    def _drop(self, e) -> None:
+        self.bytes -= e[1]
+        self.drops += 1
+
+    def _path(self) -> str:
+        return f"{self.settings.get_dir()}/{self.name}.spill"
+
+    def _put_spill(self, item, n):
+        try:
+            b = pickle.dumps(item)
+            if self._spill is None:
+                self._spill = open(self._path(), "w+b")
+            self._spill.seek(0, os.SEEK_END)
+            self._spill.write(struct.pack("<Q", len(b)) + b)
+            self.spilled += 1
+            self.spill_bytes += len(b) + 8
+        except Exception as e:
+            if self.spilled:  # would jump ahead of items on disk
+                self.drops += 1
+            else:  # keep in memory instead
+                self.queue.append((item, n))
+                self.bytes += n
+            return e
+
+    def _get_spill(self):
+        self._spill.flush()
+        self._spill.seek(self._spill_pos)
+        size = struct.unpack("<Q", self._spill.read(8))[0]
+        item = pickle.loads(self._spill.read(size))
+        self._spill_pos = self._spill.tell()
+        self.spilled -= 1
+        self.spill_bytes -= size + 8
+        if not self.spilled:  # reclaim disk once replayed
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._spill_pos = 0
+        return item
+
+    def _qsize(self) -> int:
+        return len(self.queue) + self.spilled
+
+    def _get(self):
+        if not self.queue:
+            return self._get_spill()
+        item, n = self.queue.popleft()
+        self.bytes -= n
+        return item
+
+
+def get_size(item) -> int:
+    # estimate of the memory held by a queued item, walking containers of logged data
+    if isinstance(item, (bytes, bytearray, str)):
+        return len(item)
+    elif hasattr(item, "nbytes"):
+        return item.nbytes
+    elif isinstance(item, (tuple, list)):
+        return sum(get_size(e) for e in item)
+    elif isinstance(item, dict):
+        n = sys.getsizeof(item) + 24 * len(item)  # table and boxed scalars
+        for v in item.values():
+            if type(v) is not float and type(v) is not int:  # fast path for metrics
+                n += get_size(v)
+        return n
+    return sys.getsizeof(item)
@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Union
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Cache"
+
+CACHE = None  # one hash cache per process
+MIN_SIZE = 2**20  # cheaper to rehash smaller files than to look them up
+_lock_cache = threading.Lock()
+
+
+class HashCache:
+    """Content hashes of local files keyed on path, inode, size and mtime"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=2**3)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hash(
+                path TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def get(self, path: str, stat: os.stat_result) -> Union[str, None]:
+        with self._lock:
+            r = self.conn.execute(
+                "SELECT sha256 FROM hash WHERE path = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                (path, stat.st_ino, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        return r[0] if r else None
+
+    def set(self, path: str, stat: os.stat_result, h: str) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO hash (path, inode, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_ino, stat.st_size, stat.st_mtime_ns, h),
+            )
+            self.conn.commit()
+
+
+def get_cache() -> Union[HashCache, None]:
+    global CACHE
+    with _lock_cache:
+        if CACHE is None:
+            path = os.path.join(
+                os.path.expanduser("~"), f".{__name__.split('.')[0]}", "cache.db"
+            )
+            try:
+                CACHE = HashCache(path)
+            except Exception as e:
+                logger.debug("%s: failed to open %s: %s", tag, path, e)
+                CACHE = False  # do not retry
+    return CACHE or None
+
+
+def get_hash(path: str, stat: Union[os.stat_result, None] = None) -> str:
+    stat = stat or os.stat(path)
+    cache = get_cache() if stat.st_size >= MIN_SIZE else None
+    if cache is not None:
+        try:
+            h = cache.get(path, stat)
+            if h is not None:
+                return h
+        except Exception as e:
+            logger.debug("%s: failed to read %s: %s", tag, cache.path, e)
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(2**20), b""):  # bounded memory
+            h.update(b)
+    h = h.hexdigest()
+
+    # a file written within the mtime resolution may change without a new mtime
+    if cache is not None and time.time_ns() - stat.st_mtime_ns > 2 * 10**9:
+        try:
+            cache.set(path, stat, h)
+        except Exception as e:
+            logger.debug("%s: failed to write %s: %s", tag, cache.path, e)
+    return h
@@ -79,7 +79,9 @@ class MLOPLogger(Logger):
 
     @rank_zero_only
     def log_metrics(self, metrics: Dict[str, float], step: Optional[int] = None):
-        self.op.log(data=metrics, step=step)
+        # lightning reports all metrics of a step at once: commit them with anything
+        # pending at that step so the latest step is never held back
+        self.op.log(data=metrics, step=step, commit=True)
 
     @rank_zero_only
     def log_hyperparams(self, params: Union[Dict[str, Any], Namespace]) -> None:
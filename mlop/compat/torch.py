@@ -466,7 +466,11 @@ def _backward(op, name, freq, bins):
         c[0] = 0
         hist = make_compat_histogram_tensor(grad.data, bins)
         if hist is not None:
-            op.log({f"{op.settings.x_grad_label}/{name}": hist}, step=op._step)
+            op.log(
+                {f"{op.settings.x_grad_label}/{name}": hist},
+                step=op._step,
+                commit=False,
+            )
 
     return f
 
@@ -485,7 +489,9 @@ def _forward(op, freq, bins):
                 hist = make_compat_histogram_tensor(param.data, bins)
                 if hist is not None:
                     op.log(
-                        {f"{op.settings.x_param_label}/{name}": hist}, step=op._step
+                        {f"{op.settings.x_param_label}/{name}": hist},
+                        step=op._step,
+                        commit=False,
                     )
                 else:
                     logger.error(f"{tag}: {name} does not contain a valid tensor")
@@ -1,10 +1,12 @@
-import hashlib
 import logging
 import mimetypes
 import os
 import re
 import shutil
+import tempfile
+import time
 import uuid
+import weakref
 from pathlib import Path
 from typing import Union
 
@@ -12,6 +14,9 @@ import numpy as np
 import soundfile as sf
 from PIL import Image as PILImage
 
+from .blob import put
+from .budget import BUDGET, release, unstage
+from .cache import get_hash
 from .util import get_class
 
 logger = logging.getLogger(f"{__name__.split('.')[0]}")
@@ -31,6 +36,7 @@ class File:
         **kwargs,
     ) -> None:
         self._path = os.path.abspath(path)
+        self._stat = os.stat(self._path)
         self._id = self._hash()
 
         if not name:
@@ -44,21 +50,31 @@ class File:
         self._name = name
         self._ext = os.path.splitext(self._path)[-1]
         self._type = self._mimetype()
-        self._stat = os.stat(self._path)  # os.path.getsize(self._path)
         self._url = None
 
+    def __getstate__(self):
+        # budget accounting stays with the logging process
+        return {k: v for k, v in self.__dict__.items() if k != "_budget"}
+
     def _mimetype(self) -> str:
         return mimetypes.guess_type(self._path)[0] or "application/octet-stream"
 
     def _hash(self) -> str:  # do not truncate
-        with open(self._path, "rb") as f:
-            return hashlib.sha256(f.read()).hexdigest()
+        return get_hash(self._path, self._stat)  # cached while unchanged
 
-    def _mkcopy(self, dir) -> None:
+    def _mkcopy(self, dir, blob: bool = False) -> None:
         if not hasattr(self, "_tmp"):
             self._tmp = f"{dir}/files/{self._name}-{self._id}{self._ext}"
-            shutil.copyfile(self._path, self._tmp)
-            if hasattr(self, "_image"):
+            own = self._path.startswith(os.path.abspath(dir) + os.sep)
+            if not (  # same name and content was already copied
+                os.path.exists(self._tmp)
+                and os.path.getsize(self._tmp) == self._stat.st_size
+            ):
+                if blob:  # link through the shared blob of this content
+                    put(self._path, self._tmp, self._id, own=own)
+                else:
+                    shutil.copyfile(self._path, self._tmp)
+            if hasattr(self, "_image") and own:  # never remove the caller's file
                 os.remove(self._path)
             self._path = os.path.abspath(self._tmp)
 
@@ -74,6 +90,7 @@ class Artifact(File):
         **kwargs,
     ) -> None:
         self._name = caption + f".{uuid.uuid4()}" if caption else f"{uuid.uuid4()}"
+        self._caption = caption  # names content across logs; _name is unique
         self._id = f"{uuid.uuid4()}{uuid.uuid4()}".replace("-", "")
 
         self._metadata = metadata
@@ -83,6 +100,7 @@ class Artifact(File):
     # TODO: remove legacy compat
     def add_file(self, path: str, name: str = None):
         self._name = name + f".{uuid.uuid4()}" if name else f"{uuid.uuid4()}"
+        self._caption = name
         self._path = os.path.abspath(path)
 
     def load(self, dir=None):
@@ -99,6 +117,7 @@ class Text(File):
         self._name = caption + f".{uuid.uuid4()}" if caption else f"{uuid.uuid4()}"
         self._id = f"{uuid.uuid4()}{uuid.uuid4()}".replace("-", "")
         self._ext = ".txt"
+        self._path = None
 
         if isinstance(data, str):
             if os.path.exists(data):
@@ -126,10 +145,18 @@ class Image(File):
         self,
         data: Union[str, "PILImage.Image", np.ndarray],
         caption: Union[str, None] = None,
+        format: Union[str, None] = None,
+        quality: Union[int, None] = None,
+        compress_level: Union[int, None] = None,
+        max_size: Union[int, None] = None,
     ) -> None:
         self._name = caption + f".{uuid.uuid4()}" if caption else f"{uuid.uuid4()}"
         self._id = f"{uuid.uuid4()}{uuid.uuid4()}".replace("-", "")
         self._ext = ".png"
+        self._format = format  # unset options fall back to settings on load
+        self._quality = quality
+        self._compress_level = compress_level
+        self._max_size = max_size
 
         if isinstance(data, str):
             logger.debug(f"{self.tag}: used file")
@@ -138,7 +165,7 @@ class Image(File):
         else:
             self._path = None
             class_name = get_class(data)
-            if class_name.startswith("PIL.Image.Image"):
+            if class_name.startswith("PIL.") and hasattr(data, "getbands"):
                 logger.debug(f"{self.tag}: used PILImage")
                 self._image = data
             elif class_name.startswith("matplotlib."):
@@ -153,16 +180,48 @@ class Image(File):
             else:
                 logger.debug(f"{self.tag}: attempted conversion from array")
                 self._image = make_compat_image_numpy(data)
+            if not getattr(self._image, "filename", None) or self._modified():
+                BUDGET.admit(self, "_image")  # files are read on load
 
     def load(self, dir=None):
+        s = time.time()
+        unstage(self)
+        if self._path and not self._fits(self._path):
+            self._image = PILImage.open(self._path)  # re-encode the file to fit
+            self._path = None
+        elif not self._path and not hasattr(self, "_matplotlib"):
+            path = getattr(self._image, "filename", None)
+            if path and not self._modified() and self._fits(path):
+                self._path = os.path.abspath(path)  # reuse the compressed source
+
         if not self._path:
             if dir:
+                ext, fmt, kwargs = make_compat_image_format(
+                    self._format, self._quality, self._compress_level
+                )
+                self._ext = ext
                 self._tmp = f"{dir}/files/{self._name}-{self._id}{self._ext}"
-                if hasattr(self, "_matplotlib"):
+                if hasattr(self, "_matplotlib") and fmt == "PNG" and not self._max_size:
                     make_compat_image_matplotlib(self._tmp, self._image)
+                    raw = 0
                 else:
-                    self._image.save(self._tmp, format=self._ext[1:])
+                    if hasattr(self, "_matplotlib"):
+                        self._image = make_compat_image_canvas(self._image)
+                    image = make_compat_image_size(self._image, self._max_size)
+                    if fmt == "JPEG" and image.mode not in ["RGB", "L"]:
+                        image = image.convert("RGB")  # no alpha in jpeg
+                    raw = self._image.size[0] * self._image.size[1]
+                    raw *= len(self._image.getbands())
+                    image.save(self._tmp, format=fmt, **kwargs)
                 self._path = os.path.abspath(self._tmp)
+                self._encode = (
+                    "image",
+                    time.time() - s,
+                    raw,
+                    os.path.getsize(self._tmp),
+                )
+        self._image = None  # release the raw image once encoded or reused
+        release(self)
 
         super().__init__(path=self._path, name=self._name)
         if not self._type.startswith("image/"):
@@ -170,6 +229,20 @@ class Image(File):
                 f"{self.tag}: proceeding with potentially incompatible mime type: {self._type}"
             )
 
+    def _fits(self, path) -> bool:
+        # compressed images within the size cap upload as they are
+        try:
+            with PILImage.open(path) as i:  # reads the header only
+                return i.format in ["PNG", "JPEG", "WEBP", "GIF"] and (
+                    not self._max_size or max(i.size) <= self._max_size
+                )
+        except Exception:
+            return False
+
+    def _modified(self) -> bool:
+        # pixels of an opened file that were never loaded cannot have been edited
+        return vars(self._image).get("_im", vars(self._image).get("im")) is not None
+
 
 class Audio(File):
     tag = "Audio"
@@ -179,6 +252,7 @@ class Audio(File):
         data: Union[str, np.ndarray],
         rate: Union[int, None] = 48000,
         caption: Union[str, None] = None,
+        format: Union[str, None] = None,
         **kwargs,
     ) -> None:
         # TODO: remove legacy compat
@@ -187,6 +261,8 @@ class Audio(File):
         self._name = caption + f".{uuid.uuid4()}" if caption else f"{uuid.uuid4()}"
         self._id = f"{uuid.uuid4()}{uuid.uuid4()}".replace("-", "")
         self._ext = ".wav"
+        self._format = format  # unset options fall back to settings on load
+        self._compression_level = kwargs.get("compression_level")
 
         if isinstance(data, str):
             logger.debug(f"{self.tag}: used file")
@@ -198,15 +274,45 @@ class Audio(File):
                 logger.debug(f"{self.tag}: used numpy array")
                 self._audio = data
                 self._rate = rate
+            elif hasattr(data, "detach") and hasattr(data, "numpy"):
+                logger.debug(f"{self.tag}: used tensor")
+                self._audio = make_compat_audio_torch(data)
+                self._rate = rate
             else:
                 logger.critical(f"{self.tag}: unsupported data type: %s", type(data))
+            BUDGET.admit(self, "_audio")
 
     def load(self, dir=None):
+        unstage(self)
         if not self._path:
             if dir:
+                s = time.time()
+                self._ext, fmt, subtype = make_compat_audio_format(
+                    self._format, self._rate
+                )
                 self._tmp = f"{dir}/files/{self._name}-{self._id}{self._ext}"
-                sf.write(file=self._tmp, data=self._audio, samplerate=self._rate)
+                a = self._audio
+                kwargs = {"format": fmt, "subtype": subtype}
+                if self._compression_level is not None and fmt != "WAV":
+                    kwargs["compression_level"] = self._compression_level
+                with sf.SoundFile(
+                    self._tmp,
+                    "w",
+                    samplerate=self._rate,
+                    channels=1 if a.ndim == 1 else a.shape[1],
+                    **kwargs,
+                ) as f:
+                    for i in range(0, len(a), 2**16):  # bounded copies of views
+                        f.write(a[i : i + 2**16])
                 self._path = os.path.abspath(self._tmp)
+                self._audio = None  # release the samples once encoded
+                release(self)
+                self._encode = (
+                    "audio",
+                    time.time() - s,
+                    a.nbytes,
+                    os.path.getsize(self._tmp),
+                )
 
         super().__init__(path=self._path, name=self._name)
 
@@ -216,7 +322,7 @@ class Video(File):
 
     def __init__(
         self,
-        data: Union[str, np.ndarray],
+        data: Union[str, np.ndarray, None] = None,
         rate: Union[int, None] = 30,
         caption: Union[str, None] = None,
         format: Union[str, None] = None,
@@ -227,82 +333,150 @@ class Video(File):
         self._name = caption + f".{uuid.uuid4()}" if caption else f"{uuid.uuid4()}"
         self._id = f"{uuid.uuid4()}{uuid.uuid4()}".replace("-", "")
         self._ext = f".{format}" if format in ["mp4", "webm", "ogg", "gif"] else ".mp4"
+        self._rate = rate
+        self._writer = None  # open while frames are appended
+        self._stream = None
 
-        if isinstance(data, str):
+        if data is None:
+            logger.debug(f"{self.tag}: used appended frames")
+            self._path = None
+            self._data = None
+        elif isinstance(data, str):
             logger.debug(f"{self.tag}: used file")
             self._video = "file"
             self._path = os.path.abspath(data)
         else:
             self._path = None
             if hasattr(data, "numpy") or isinstance(data, np.ndarray):
-                if hasattr(data, "numpy"):
-                    logger.debug(f"{self.tag}: used tensor")
-                    self._data = data.numpy()
-                else:
-                    logger.debug(f"{self.tag}: used numpy array")
-                    self._data = data
-                self._rate = rate
-                self._video = make_compat_video_moviepy(self._data, self._rate)
+                logger.debug(
+                    f"{self.tag}: used {'tensor' if hasattr(data, 'numpy') else 'numpy array'}"
+                )
+                self._data = data  # frames are converted one at a time on write
+                if data.ndim < 4:
+                    logger.critical(
+                        f"{self.tag}: video data must have at least 4 dimensions: time, channel, height, width"
+                    )
             else:
                 logger.critical(f"{self.tag}: unsupported data type: %s", type(data))
+            BUDGET.admit(self, "_data")
+
+    def append_frame(self, frame: Union[np.ndarray, any]) -> None:
+        """Encode one frame of shape (channel, height, width), or a batch of them tiled"""
+        if self._writer is None:
+            fd, self._stream = tempfile.mkstemp(suffix=self._ext)
+            os.close(fd)
+            self._writer = make_compat_video_writer(self._stream, self._ext, self._rate)
+            self._cleanup = weakref.finalize(
+                self, remove_stream, self._writer, self._stream
+            )  # if never logged
+            self._cleanup.atexit = False  # runs may still encode it at exit
+        f = get_frame(frame if frame.ndim == 4 else frame[None])
+        if f is not None:
+            self._writer.append_data(f)
 
     def load(self, dir=None):
+        unstage(self)
         if not self._path:
             if dir:
                 self._tmp = f"{dir}/files/{self._name}-{self._id}{self._ext}"
-                try:
-                    make_compat_video_imageio(
-                        self._tmp, self._video, self._rate
-                    )  # self._video.write_videofile(self._tmp)
-                except TypeError as e:
-                    Path(self._tmp).touch()
-                    logger.critical("%s: failed to write video: %s", self.tag, e)
+                if self._stream is not None:
+                    if self._writer is not None:
+                        self._writer.close()
+                        self._writer = None
+                    shutil.move(self._stream, self._tmp)
+                    self._stream = None
+                    self._cleanup.detach() if hasattr(self, "_cleanup") else None
+                else:
+                    try:
+                        w = make_compat_video_writer(self._tmp, self._ext, self._rate)
+                        for f in make_compat_video_frames(self._data):
+                            w.append_data(f)
+                        w.close()
+                    except Exception as e:
+                        Path(self._tmp).touch()
+                        logger.critical("%s: failed to write video: %s", self.tag, e)
                 self._path = os.path.abspath(self._tmp)
+                self._data = None  # release the source once encoded
+                release(self)
 
         super().__init__(path=self._path, name=self._name)
 
 
-def make_compat_video_imageio(f, clip, rate):
-    import imageio
+def make_compat_audio_torch(val: any) -> np.ndarray:
+    if hasattr(val, "requires_grad") and val.requires_grad:
+        val = val.detach()
+    val = val.cpu().numpy()  # shares memory with tensors already on the host
+    if val.ndim == 2 and val.shape[0] < val.shape[1]:
+        val = val.T  # (channel, time) view as (time, channel)
+    return val
+
 
-    writer = imageio.save(f, fps=rate)
-    for i in clip.iter_frames(fps=rate):
-        writer.append_data(i)
+def make_compat_audio_format(format, rate):
+    format = (format or "wav").lower()
+    if format == "opus" and rate not in [8000, 12000, 16000, 24000, 48000]:
+        logger.warning(
+            f"{tag}: opus does not support a sample rate of {rate}: proceeding with vorbis"
+        )
+        format = "ogg"
+    if format == "flac":
+        return ".flac", "FLAC", "PCM_16"
+    if format in ["ogg", "vorbis"]:
+        return ".ogg", "OGG", "VORBIS"
+    if format == "opus":
+        return ".opus", "OGG", "OPUS"
+    if format != "wav":
+        logger.warning(
+            f"{tag}: unsupported audio format {format}, expected wav, flac, ogg or opus: proceeding with wav"
+        )
+    return ".wav", "WAV", None
+
+
+def remove_stream(writer, path) -> None:
+    # frames appended to a video that was never logged
     writer.close()
+    if os.path.exists(path):
+        os.remove(path)
 
 
-def make_compat_video_moviepy(v: any, rate: int) -> any:
-    from moviepy.editor import ImageSequenceClip
+def make_compat_video_writer(f, ext, rate):
+    import imageio
 
-    t = make_compat_video_numpy(v)
-    # _, h, w, c = t.shape
-    clip = ImageSequenceClip(list(t), fps=rate)
-    return clip
+    codec = {".webm": "libvpx-vp9", ".ogg": "libtheora"}.get(ext)
+    return imageio.get_writer(f, fps=rate, **({"codec": codec} if codec else {}))
 
 
-def make_compat_video_numpy(v: any) -> any:
-    import numpy as np
+def make_compat_video_frames(v: any):
+    # yields frames of shape (height, width, channel), tiling batched videos
+    if v is None or v.ndim < 4:
+        return
+    if v.ndim == 4:
+        v = v[None]
+    for t in range(v.shape[1]):
+        f = get_frame(v[:, t])
+        if f is not None:
+            yield f
 
-    if v.ndim < 4:
+
+def get_frame(v: any) -> Union[np.ndarray, None]:
+    # (batch, channel, height, width) to one uint8 frame with the batch on a grid
+    if hasattr(v, "detach"):
+        v = v.detach().cpu().numpy()  # one frame leaves the device at a time
+    v = np.asarray(v)
+    if v.ndim != 4:
         logger.critical(
-            f"{tag}: video data must have at least 4 dimensions: time, channel, height, width"
+            f"{tag}: video frame must have 4 dimensions: batch, channel, height, width"
         )
         return None
-    elif v.ndim == 4:
-        v = v.reshape(1, *v.shape)
-    b, t, c, h, w = v.shape
-
+    b, c, h, w = v.shape
     if v.dtype != np.uint8:
-        logger.debug(f"{tag}: converting video data to uint8")
         v = v.astype(np.uint8)
 
     rows = 2 ** ((b.bit_length() - 1) // 2)
-    cols = v.shape[0] // rows
+    cols = b // rows
 
-    v = v.reshape(rows, cols, t, c, h, w)
-    v = np.transpose(v, axes=(2, 0, 4, 1, 5, 3))
-    v = v.reshape(t, rows * h, cols * w, c)
-    return v
+    v = v[: rows * cols].reshape(rows, cols, c, h, w)
+    v = np.transpose(v, axes=(0, 3, 1, 4, 2))
+    return np.ascontiguousarray(v.reshape(rows * h, cols * w, c))
 
 
 def make_compat_image_matplotlib(f, val: any) -> any:
@@ -325,6 +499,44 @@ def make_compat_image_matplotlib(f, val: any) -> any:
     val.savefig(f, format="png")
 
 
+def make_compat_image_canvas(val: any) -> any:
+    import matplotlib.pyplot as plt
+
+    if val == plt:
+        val = val.gcf()
+    val = getattr(val, "figure", val)
+    val.canvas.draw()
+    return PILImage.fromarray(np.asarray(val.canvas.buffer_rgba())).convert("RGB")
+
+
+def make_compat_image_size(image, max_size):
+    if not max_size or max(image.size) <= max_size:
+        return image
+    r = max_size / max(image.size)
+    size = (max(1, round(image.size[0] * r)), max(1, round(image.size[1] * r)))
+    return image.resize(size, PILImage.BILINEAR, reducing_gap=2.0)  # fast
+
+
+def make_compat_image_format(format, quality=None, compress_level=None):
+    format = (format or "png").lower()
+    if format in ["jpg", "jpeg"]:
+        return ".jpg", "JPEG", {"quality": quality or 85}
+    if format == "webp":
+        kwargs = {"quality": quality or 80, "method": 4}
+        if compress_level is not None:
+            kwargs["method"] = compress_level
+        return ".webp", "WEBP", kwargs
+    if format != "png":
+        logger.warning(
+            f"{tag}: unsupported image format {format}, expected png, webp or jpeg: proceeding with png"
+        )
+    return (
+        ".png",
+        "PNG",
+        {"compress_level": 6 if compress_level is None else compress_level},
+    )
+
+
 def make_compat_image_torch(val: any) -> any:
     from torchvision.utils import make_grid
 
@@ -351,7 +563,7 @@ def make_compat_image_numpy(val: any) -> any:
         val = (val - np.min(val)) / (np.max(val) - np.min(val))
     if np.max(val) <= 1:
         val = (val * 255).astype(np.int32)
-    val.clip(0, 255).astype(np.uint8)
+    val = val.clip(0, 255).astype(np.uint8)
 
     image = PILImage.fromarray(val, mode="RGBA" if val.shape[-1] == 4 else "RGB")
     return image
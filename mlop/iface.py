@@ -1,4 +1,7 @@
+import concurrent.futures
+import gzip
 import logging
+import os
 import queue
 import threading
 import time
@@ -10,20 +13,26 @@ from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn
 
 from .api import (
     make_compat_data_v1,
-    make_compat_file_v1,
+    make_compat_file_batch_v1,
     make_compat_meta_v1,
+    make_compat_num_batch_v1,
     make_compat_num_v1,
     make_compat_start_v1,
     make_compat_status_v1,
     make_compat_storage_v1,
 )
+from .buffer import Buffer
 from .log import _stderr
 from .sets import Settings
-from .util import print_url
+from .transfer import DaemonExecutor, HTTPTransfer, Multipart, find, resume, upload
+from .util import import_lib, print_url
 
 logger = logging.getLogger(f"{__name__.split('.')[0]}")
 tag = "Interface"
 
+CLIENTS = {}  # get_client_key -> httpx.Client
+_lock_client = threading.Lock()
+
 
 class ServerInterface:
     def __init__(self, config: dict, settings: Settings) -> None:
@@ -42,41 +51,26 @@ class ServerInterface:
         self.headers_num = self.headers.copy()
         self.headers_num.update({"Content-Type": "application/x-ndjson"})
 
-        self.client = httpx.Client(
-            verify=not self.settings.insecure_disable_ssl,
-            proxy=self.settings.http_proxy or self.settings.https_proxy or None,
-            limits=httpx.Limits(
-                max_keepalive_connections=self.settings.x_file_stream_max_conn,
-                max_connections=self.settings.x_file_stream_max_conn,
-            ),
-            timeout=httpx.Timeout(
-                self.settings.x_file_stream_timeout_seconds,
-                # connect=settings.x_file_stream_timeout_seconds,
-            ),
-        )
-        self.client_storage = httpx.Client(
-            # http1=False, # TODO: set http2
-            verify=not self.settings.insecure_disable_ssl,
-            proxy=self.settings.http_proxy or self.settings.https_proxy or None,
-            timeout=httpx.Timeout(self.settings.x_file_stream_timeout_seconds),
-        )
-        self.client_api = httpx.Client(
-            verify=not self.settings.insecure_disable_ssl,
-            proxy=self.settings.http_proxy or self.settings.https_proxy or None,
-            timeout=httpx.Timeout(
-                self.settings.x_file_stream_timeout_seconds,
-            ),
-        )
+        self.client = get_client(self.settings)  # shared by all runs in the process
+        self.client_storage = get_client(self.settings, "storage")  # own pool
+        self.client_api = self.client
 
         self._stop_event = threading.Event()
 
-        self._queue_num = queue.Queue()
+        self._queue_num = Buffer(settings, "num")
         self._thread_num = None
-        self._queue_data = queue.Queue()
+        self._queue_data = Buffer(settings, "data")
         self._thread_data = None
+        self._queue_file = Buffer(settings, "file", policy="block")  # holds files
         self._thread_file = None
-        self._thread_storage = None
-        self._thread_meta = None
+        self._executor = DaemonExecutor(
+            self.settings.x_file_stream_max_conn, tag
+        )  # file, storage and meta requests
+        self._lock_uploads = threading.Lock()
+        self._uploads = {}  # future -> (kind, name) of pending request
+        self._failed = []  # (kind, name) of failed requests
+        self._stored = set()  # (name, hash) of files registered for upload by the run
+        self._transfer = HTTPTransfer(self.client_storage, settings)
 
         self._queue_message = self.settings.message
         self._thread_message = None
@@ -95,8 +89,15 @@ class ServerInterface:
         self._lock_progress = threading.Lock()
         self._total = 0
 
+        self._compress = get_compress(self.settings)
+        self._lock_compress = threading.Lock()
+        self._raw, self._sent = 0, 0  # bytes before and after compression
+
     def start(self) -> None:
-        logger.info(f"{tag}: find live updates at {print_url(self.settings.url_view)}")
+        if self.settings.url_view:
+            logger.info(
+                f"{tag}: find live updates at {print_url(self.settings.url_view)}"
+            )
         if self._thread_num is None:
             self._thread_num = threading.Thread(
                 target=self._worker_publish,
@@ -123,6 +124,11 @@ class ServerInterface:
                 daemon=True,
             )
             self._thread_data.start()
+        if self._thread_file is None:
+            self._thread_file = threading.Thread(
+                target=self._worker_publish_file, daemon=True
+            )
+            self._thread_file.start()
         if self._thread_message is None:
             self._thread_message = threading.Thread(
                 target=self._worker_publish,
@@ -141,6 +147,8 @@ class ServerInterface:
                 target=self._worker_progress, daemon=True
             )
             self._thread_progress.start()
+        if self.settings.x_file_stream_resume:
+            self._resume()
 
     def publish(
         self,
@@ -153,20 +161,18 @@ class ServerInterface:
         with self._lock_progress:  # enforce one thread at a time
             self._total += 1
             if num:
-                self._queue_num.put(
-                    make_compat_num_v1(num, timestamp, step), block=False
-                )
+                self._queue_num.put(make_compat_num_v1(num, timestamp, step))
             if data:
-                self._queue_data.put(
-                    make_compat_data_v1(data, timestamp, step), block=False
-                )
+                self._queue_data.put(make_compat_data_v1(data, timestamp, step))
             if file:
-                self._thread_file = threading.Thread(
-                    target=self._worker_file,
-                    args=(file, make_compat_file_v1(file, timestamp, step)),
-                    daemon=True,
-                )  # TODO: batching
-                self._thread_file.start()
+                self._queue_file.put((file, timestamp, step))  # registered in batches
+
+    def publish_batch(self, keys, steps, values, timestamps) -> None:
+        with self._lock_progress:
+            self._total += len(steps)
+            self._queue_num.put(
+                make_compat_num_batch_v1(keys, steps, values, timestamps)
+            )
 
     def save(self) -> None:
         while not self._queue_num.empty() or not self._queue_data.empty():
@@ -181,33 +187,76 @@ class ServerInterface:
 
         self._stop_event.set()
         self.save()
+        self._join()
+        if self._thread_progress is not None:
+            self._thread_progress.join(timeout=None)
+        for q in [
+            self._queue_num,
+            self._queue_data,
+            self._queue_file,
+            self._queue_message,
+        ]:
+            if isinstance(q, Buffer):
+                logger.debug(f"{tag}: queue {q.name}: {q.stats()}")
+                q.close()
+
+        if self._progress_task is not None:
+            self._progress.remove_task(self._progress_task)
+            self._progress_task = None
+        self._progress.stop()
+        self._update_status(self.settings)
 
+        if self.settings.url_view:
+            logger.info(
+                f"{tag}: find {self._total} synced entries at {print_url(self.settings.url_view)}"
+            )
+        if self._compress is not None and self._sent:
+            logger.info(
+                f"{tag}: compressed {self._raw} to {self._sent} bytes ({self._raw / self._sent:.2f}x)"
+            )
+        if self.settings.meta and self.settings.mode == "debug":
+            logger.info(f"{tag}: recorded metadata:")
+            for e in sorted(self.settings.meta.values(), key=lambda e: e["id"]):
+                logger.info(f"    {e['name']} ({e['kind']}, step {e['step']})")
+
+    def _join(self) -> None:
         for t in [
             self._thread_num,
             self._thread_data,
             self._thread_file,
-            self._thread_storage,
             self._thread_message,
-            self._thread_meta,
-            self._thread_progress,
         ]:
             if t is not None:
                 t.join(timeout=None)
                 t = None
 
-        if self._progress_task is not None:
-            self._progress.remove_task(self._progress_task)
-            self._progress_task = None
-        self._progress.stop()
-        self._update_status(self.settings)
-
-        logger.info(
-            f"{tag}: find {self._total} synced entries at {print_url(self.settings.url_view)}"
-        )
-        if self.settings.meta and self.settings.mode == "debug":
-            logger.info(f"{tag}: recorded metadata:")
-            for e in sorted(self.settings.meta, key=len):
-                logger.info(f"    {e}")
+        end = time.time() + self.settings.x_file_stream_join_timeout_seconds
+        while self._uploads and time.time() < end:  # files schedule storage uploads
+            with self._lock_uploads:
+                pending = list(self._uploads)
+            concurrent.futures.wait(pending, timeout=max(0, end - time.time()))
+        with self._lock_uploads:
+            pending = list(self._uploads.values())
+        self._executor.shutdown(wait=False, cancel_futures=True)  # workers are daemons
+        for kind, names in get_kinds(pending).items():
+            logger.error(
+                f"{tag}: {len(names)} {kind} still pending after {self.settings.x_file_stream_join_timeout_seconds}s: {', '.join(names[:8])}"
+            )
+        for kind, names in get_kinds(self._failed).items():
+            logger.error(f"{tag}: {len(names)} {kind} failed: {', '.join(names[:8])}")
+
+    def _schedule(self, kind, name, fn, *args) -> concurrent.futures.Future:
+        f = self._executor.submit(fn, *args)
+        with self._lock_uploads:
+            self._uploads[f] = (kind, name)
+        f.add_done_callback(self._done)
+        return f
+
+    def _done(self, f) -> None:
+        with self._lock_uploads:
+            e = self._uploads.pop(f, None)
+            if f.cancelled() or f.exception() is not None or f.result() is None:
+                self._failed.append(e)
 
     def _update_status(self, settings, trace: Union[Any, None] = None):
         r = self._post_v1(
@@ -222,10 +271,7 @@ class ServerInterface:
         num: Union[List[str], None] = None,
         df: Union[Dict[str, List[str]], None] = None,
     ):
-        self._thread_meta = threading.Thread(
-            target=self._worker_meta, args=(num, df), daemon=True
-        )
-        self._thread_meta.start()
+        self._schedule("meta", "meta", self._worker_meta, num, df)
 
     def _worker_progress(self):
         while not (
@@ -269,44 +315,135 @@ class ServerInterface:
                     q,
                     client=self.client,
                     name=name,
+                    compress=True,
                 )
 
-    def _worker_storage(self, f, url, data):
-        _ = self._put_v1(
-            url,
-            {
-                "Content-Type": f._type,  # "application/octet-stream"
-            },
-            data,
-            client=self.client_storage,
+    def _worker_storage(self, f, url):
+        r = None
+        try:
+            if (
+                self.settings.x_file_stream_multipart
+                and os.path.getsize(f._path) > self.settings.x_file_stream_part_size
+            ):
+                r = self._worker_multipart(f, url)
+            else:
+                r = self._put_v1(
+                    url,
+                    {
+                        "Content-Type": f._type,  # "application/octet-stream"
+                        "Content-Length": str(os.path.getsize(f._path)),
+                    },
+                    lambda: get_chunks(f._path, self.settings.x_file_stream_chunk_size),
+                    client=self.client_storage,
+                )  # stream from disk; reopened on each retry
+        finally:
+            if r is None:  # let a later log of the same content register again
+                self._release([f])
+        return r
+
+    def _worker_multipart(self, f, url):
+        m = Multipart(
+            os.path.join(
+                self.settings.get_dir(), "uploads", os.path.basename(f._path) + ".json"
+            ),
+            url=url,
+            file=f._path,
+            size=os.path.getsize(f._path),
+            type=f._type,
+            part_size=self.settings.x_file_stream_part_size,
         )
+        return upload(self._transfer, m, self.settings) or None
+
+    def _resume(self) -> None:
+        # pick up uploads that earlier processes left unfinished in this project
+        for path in find(os.path.dirname(self.settings.get_dir())):
+            self._schedule(
+                "upload",
+                os.path.basename(path),
+                resume,
+                path,
+                self._transfer,
+                self.settings,
+            )
+
+    def _worker_publish_file(self):
+        q = self._queue_file
+        while not (q.empty() and self._stop_event.is_set()):
+            if q.empty():
+                time.sleep(self.settings.x_internal_check_process)
+            else:
+                b = []
+                for _ in self._queue_iter(q, b):  # coalesce files of many steps
+                    pass
+                if self._worker_file(b) is None:
+                    with self._lock_uploads:
+                        self._failed.extend(
+                            ("upload", f"{f._name}{f._ext}")
+                            for file, _, _ in b
+                            for fel in file.values()
+                            for f in fel
+                        )
 
-    def _worker_file(self, file, q):
+    def _claim(self, items):
+        # drop files whose content the run already registered, since the server
+        # gives every registration a storage url of its own that expects a put
+        r = []
+        with self._lock_uploads:
+            for file, timestamp, step in items:
+                d = {}
+                for k, fel in file.items():
+                    for f in fel:
+                        key = get_key(f)
+                        if key in self._stored:
+                            logger.debug(f"{tag}: skipped upload of unchanged {key[0]}")
+                            continue
+                        self._stored.add(key)
+                        d.setdefault(k, []).append(f)
+                if d:
+                    r.append((d, timestamp, step))
+        return r
+
+    def _release(self, files):
+        with self._lock_uploads:
+            for f in files:
+                self._stored.discard(get_key(f))
+
+    def _worker_file(self, items):
+        items = self._claim(items)
+        if not items:
+            return True
         r = self._post_v1(
             self.settings.url_file,
             self.headers,
-            q,
+            make_compat_file_batch_v1(items),
             client=self.client,
+            compress=True,
         )
         try:
-            d = r.json()
-            for k, fel in file.items():
-                for f in fel:
-                    url = make_compat_storage_v1(f, d[k])
-                    with open(
-                        f._path, "rb"
-                    ) as file:  # TODO: data = open(f._path, "rb")
-                        data = file.read()
-                    if not url:
-                        logger.critical(f"{tag}: file api did not provide storage url")
-                    else:
-                        self._thread_storage = threading.Thread(
-                            target=self._worker_storage,
-                            args=(f, url, data),
-                            daemon=True,
-                        )
-                        self._thread_storage.start()
+            d = make_compat_storage_v1(r.json())
+            for file, _, _ in items:
+                for k, fel in file.items():
+                    for f in fel:
+                        urls = d.get((k, f"{f._name}{f._ext}"))
+                        url = urls.popleft() if urls else None
+                        if not url:
+                            logger.critical(
+                                f"{tag}: file api did not provide storage url"
+                            )
+                            self._release([f])
+                        else:
+                            self._schedule(
+                                "upload",
+                                f"{f._name}{f._ext}",
+                                self._worker_storage,
+                                f,
+                                url,
+                            )
+            return r
         except Exception as e:
+            self._release(
+                f for file, _, _ in items for fel in file.values() for f in fel
+            )
             logger.critical(
                 "%s: failed to send files to %s: [%s] %s",
                 tag,
@@ -316,6 +453,7 @@ class ServerInterface:
             )
 
     def _worker_meta(self, num=None, file=None):
+        r = None
         if num:
             r = self._post_v1(
                 self.settings.url_meta,
@@ -331,6 +469,7 @@ class ServerInterface:
                     make_compat_meta_v1(v, k, self.settings),
                     client=self.client_api,
                 )
+        return r
 
     def _queue_iter(self, q, b):
         s = time.time()
@@ -360,7 +499,11 @@ class ServerInterface:
             return None
 
         try:
-            r = method(url, content=content, headers=headers)
+            r = method(
+                url,
+                content=content() if callable(content) else content,
+                headers=headers,
+            )
             if r.status_code in [200, 201]:
                 return r
             logger.warning(
@@ -377,16 +520,14 @@ class ServerInterface:
                 type(e).__name__,
                 e,
             )
-        time.sleep(
-            min(
-                self.settings.x_file_stream_retry_wait_min_seconds * (2 ** (retry + 1)),
-                self.settings.x_file_stream_retry_wait_max_seconds,
+        if retry + 1 < self.settings.x_file_stream_retry_max:  # none after the last
+            time.sleep(
+                min(
+                    self.settings.x_file_stream_retry_wait_min_seconds
+                    * (2 ** (retry + 1)),
+                    self.settings.x_file_stream_retry_wait_max_seconds,
+                )
             )
-        )
-
-        if q is not None:  # requeue items
-            for i in q:
-                content.put(i, block=False)
         return self._try(method, url, headers, content, name=name, q=q, retry=retry + 1)
 
     def _put_v1(self, url, headers, content, client, name="put"):
@@ -398,9 +539,21 @@ class ServerInterface:
             name=name,
         )
 
-    def _post_v1(self, url, headers, q, client, name: Union[str, None] = "post"):
+    def _post_v1(
+        self,
+        url,
+        headers,
+        q,
+        client,
+        name: Union[str, None] = "post",
+        compress: bool = False,
+    ):
         b, r = [], None
-        content = self._queue_iter(q, b) if isinstance(q, queue.Queue) else q
+        content = (
+            b"".join(self._queue_iter(q, b)) if isinstance(q, queue.Queue) else q
+        )  # materialise on the sender thread so retries resend the same body
+        if compress and self._compress is not None:
+            content, headers = self._compress_v1(content, headers)
 
         s = time.time()
         r = self._try(
@@ -422,3 +575,127 @@ class ServerInterface:
                 f"{tag}: {name}: sent {len(b)} line(s) at {len(b) / (time.time() - s):.2f} lines/s to {url}"
             )
         return r
+
+    def _post_webhook(self, url, content):
+        return self._post_v1(
+            url,
+            {"Content-Type": "application/json"},
+            content,
+            self.client,  # TODO: check client
+        )
+
+    def _compress_v1(self, content, headers):
+        if (
+            not isinstance(content, bytes)
+            or len(content) < self.settings.x_file_stream_compression_min_size
+        ):
+            return content, headers
+        encoding, f = self._compress
+        try:
+            c = f(content)
+        except Exception as e:
+            logger.debug("%s: failed to compress with %s: %s", tag, encoding, e)
+            return content, headers
+        with self._lock_compress:
+            self._raw += len(content)
+            self._sent += len(c)
+        return c, {**headers, "Content-Encoding": encoding}
+
+
+def get_key(f):
+    # (name, hash) of uploaded content; artifact names carry a uuid, so use the caption
+    n = getattr(f, "_caption", None) or f._name
+    return (f"{n}{f._ext}", f._id)
+
+
+def get_kinds(requests):
+    # names of (kind, name) requests grouped under a readable label per kind
+    r = {}
+    for kind, name in requests:
+        k = "upload(s)" if kind == "upload" else f"{kind} request(s)"
+        r.setdefault(k, []).append(name)
+    return r
+
+
+def get_chunks(path, size):
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(size)
+            if not b:
+                break
+            yield b
+
+
+def get_client(settings: Settings, kind: str = "api") -> httpx.Client:
+    key = get_client_key(settings, kind)
+    with _lock_client:
+        c = CLIENTS.get(key)
+        if c is None or c.is_closed:
+            c = CLIENTS[key] = httpx.Client(
+                http2=True,  # multiplex streams to each host over one connection
+                verify=key[1],
+                proxy=key[2],
+                limits=httpx.Limits(
+                    max_keepalive_connections=key[3], max_connections=key[3]
+                ),
+                timeout=get_timeout(key),
+            )
+    return c
+
+
+def get_client_key(settings: Settings, kind: str) -> tuple:
+    # storage puts get a pool of their own so large uploads never hold the slots
+    # that api and ingest posts need; runs configured differently never share one
+    return (
+        kind,
+        not settings.insecure_disable_ssl,
+        settings.http_proxy or settings.https_proxy or None,
+        settings.x_file_stream_max_conn,
+        settings.x_file_stream_timeout_seconds,
+    )
+
+
+def get_timeout(key) -> httpx.Timeout:
+    # waiting for a free storage connection is queueing, not a failed request
+    return httpx.Timeout(key[4], pool=None if key[0] == "storage" else key[4])
+
+
+def warm_client(settings: Settings) -> None:
+    def f(client, urls):
+        for url in urls:  # open connections while the run is being created
+            try:
+                client.head(url)
+            except Exception as e:
+                logger.debug("%s: failed to warm up connection to %s: %s", tag, url, e)
+
+    threading.Thread(
+        target=f,
+        args=(get_client(settings), [settings.url_ingest, settings.url_py]),
+        daemon=True,
+    ).start()
+
+
+def get_compress(settings):
+    encoding, level = (
+        settings.x_file_stream_compression,
+        settings.x_file_stream_compression_level,
+    )
+    if encoding == "zstd":
+        zstd = import_lib("zstandard")
+        if zstd is not None:
+            level = 3 if level is None else level
+
+            def f(b):  # compressors are not thread-safe
+                return zstd.ZstdCompressor(level=level).compress(b)
+
+            return encoding, f
+        logger.warning(f"{tag}: zstandard not installed: proceeding with gzip")
+        encoding = "gzip"
+    if encoding == "gzip":
+        level = 6 if level is None else level
+        return encoding, lambda b: gzip.compress(b, compresslevel=level, mtime=0)
+    if encoding is not None:
+        logger.warning(
+            f"{tag}: unsupported compression {encoding}, expected gzip or zstd: proceeding without"
+        )
+    return None
@@ -3,6 +3,7 @@ from typing import Any, Dict, Union
 
 import mlop
 
+from .iface import warm_client
 from .op import Op
 from .sets import Settings, setup
 from .util import gen_id, get_char
@@ -18,7 +19,6 @@ class OpInit:
 
     def init(self) -> Op:
         op = Op(config=self.config, settings=self.settings)
-        op.settings.meta = []  # TODO: check
         op.start()
         return op
 
@@ -46,6 +46,9 @@ def init(
     )  # datetime.now().strftime("%Y%m%d"), str(int(time.time()))
     # settings._op_id = id if id else gen_id(seed=settings.project)
 
+    if settings.mode != "noop" and not settings.disable_iface and not settings.offline:
+        warm_client(settings)  # overlap handshakes with login and run creation
+
     try:
         op = OpInit(config=config)
         op.setup(settings=settings)
@@ -0,0 +1,131 @@
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Union
+
+from .budget import get_size as get_buffer_size
+from .file import Artifact, Audio, File, Image, Text, Video
+from .sets import Settings
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Media"
+
+EXECUTOR = ["thread", "process"]
+
+
+class MediaExecutor:
+    """Encodes, hashes and copies logged files in parallel, bounded by bytes in flight"""
+
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.max_bytes = settings.x_media_max_bytes
+        kind = settings.x_media_executor
+        if kind not in EXECUTOR:
+            logger.warning(
+                f"{tag}: unsupported executor {kind}, expected one of {EXECUTOR}: proceeding with thread"
+            )
+            kind = "thread"
+        workers = settings.x_media_workers or min(2**5, os.cpu_count() or 1)
+        self._pool = (
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            if kind == "process"  # for codecs that hold the gil
+            else concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=tag
+            )
+        )
+        if kind == "process":
+            self._pool.submit(int).result()  # fork before encoders open pipes
+        self._opts = get_opts(settings)
+        self._cond = threading.Condition()
+        self._bytes = 0
+
+    def submit(self, f: File) -> concurrent.futures.Future:
+        if getattr(f, "_writer", None) is not None:
+            r = concurrent.futures.Future()  # the open writer cannot move
+            r.set_result(
+                load(f, self.settings.get_dir(), self.settings.x_file_blob, self._opts)
+            )
+            return r
+        n = get_size(f)
+        with self._cond:  # admit at least one file however large
+            while self._bytes and self._bytes + n > self.max_bytes:
+                self._cond.wait()
+            self._bytes += n
+        r = self._pool.submit(
+            load, f, self.settings.get_dir(), self.settings.x_file_blob, self._opts
+        )
+        r.add_done_callback(lambda _: self._release(n))
+        return r
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def _release(self, n) -> None:
+        with self._cond:
+            self._bytes -= n
+            self._cond.notify_all()
+
+
+def load(f: File, dir: str, blob: bool = False, opts: Dict = {}) -> File:
+    for k, v in opts.get(f.tag, {}).items():  # per-call options take precedence
+        if getattr(f, k, None) is None:
+            setattr(f, k, v)
+    if isinstance(f, (Artifact, Text, Image, Audio, Video)):
+        f.load(dir)
+    # TODO: add step to serialise data for files
+    f._mkcopy(dir, blob=blob)  # key independent
+    return f
+
+
+def get_opts(settings: Settings) -> Dict[str, Dict[str, Any]]:
+    return {
+        "Image": {
+            "_format": settings.x_image_format,
+            "_quality": settings.x_image_quality,
+            "_compress_level": settings.x_image_compress_level,
+            "_max_size": settings.x_image_max_size,
+        },
+        "Audio": {
+            "_format": settings.x_audio_format,
+            "_compression_level": settings.x_audio_compression_level,
+        },
+    }
+
+
+def add_stats(stats: Dict[str, List], f: File) -> None:
+    e = getattr(f, "_encode", None)  # (kind, seconds, raw bytes, encoded bytes)
+    if e is not None:
+        s = stats.setdefault(e[0], [0, 0.0, 0, 0])
+        s[0], s[1], s[2], s[3] = s[0] + 1, s[1] + e[1], s[2] + e[2], s[3] + e[3]
+
+
+def log_stats(stats: Dict[str, List]) -> None:
+    for k, (n, t, raw, size) in stats.items():
+        logger.debug(
+            f"{tag}: {k}: encoded {n} file(s) in {t:.2f}s: {raw / 2**20:.1f} MiB raw to {size / 2**20:.1f} MiB, saved {(raw - size) / 2**20:.1f} MiB"
+        )
+
+
+def get_size(f: File) -> int:
+    # memory held by a file until it is written out
+    for k in ["_image", "_audio", "_data", "_text"]:
+        v = getattr(f, k, None)
+        if get_buffer_size(v):
+            return get_buffer_size(v)
+        if isinstance(v, str) and k == "_text":
+            return len(v)
+    return 0
+
+
+def get_files(data) -> list:
+    r = []
+    for v in data.values() if isinstance(data, dict) else []:
+        for e in v if isinstance(v, list) else [v]:
+            if isinstance(e, File) and not getattr(e, "_dropped", False):
+                r.append(e)
+    return r
+
+
+def get_executor(settings: Settings) -> Union[MediaExecutor, None]:
+    return MediaExecutor(settings) if settings.x_media_executor else None
@@ -7,10 +7,13 @@ import signal
 import threading
 import time
 import traceback
-from typing import Any, Dict, Mapping, Union
+from typing import Any, Dict, List, Mapping, Union
+
+import numpy as np
 
 import mlop
 
+from .aiface import AsyncServerInterface
 from .api import (
     make_compat_alert_v1,
     make_compat_monitor_v1,
@@ -19,13 +22,18 @@ from .api import (
     make_compat_webhook_v1,
 )
 from .auth import login
+from .budget import BUDGET, release
+from .buffer import Buffer
 from .data import Data
-from .file import Artifact, Audio, File, Image, Text, Video
+from .file import File
 from .iface import ServerInterface
 from .log import setup_logger, teardown_logger
+from .media import add_stats, get_executor, get_files, get_opts, load, log_stats
+from .reduce import make_reducer
 from .store import DataStore
+from .sync import OfflineInterface
 from .sys import System
-from .util import dict_to_json, get_char, get_val, to_json
+from .util import Registry, dict_to_json, get_array, get_tensors, get_val, to_json
 
 logger = logging.getLogger(f"{__name__.split('.')[0]}")
 tag = "Operation"
@@ -79,8 +87,10 @@ class OpMonitor:
                         client=self.op._iface.client,
                     )
                     if self.op._iface
+                    and not isinstance(self.op._iface, AsyncServerInterface)
+                    and not self.op.settings.offline
                     else None
-                )
+                )  # polled on the event loop by the async engine, never offline
                 if hasattr(r, "json") and r.json()["status"] == "CANCELLED":
                     logger.critical(f"{tag}: server finished run")
                     os._exit(signal.SIGINT.value)  # TODO: do a more graceful exit
@@ -100,23 +110,29 @@ class Op:
             self.settings.disable_store = True
         else:
             # TODO: set up tmp dir
-            login(settings=self.settings)
+            login(settings=self.settings) if not self.settings.offline else None
             if self.settings._sys == {}:
                 self.settings._sys = System(self.settings)
-            tmp_iface = ServerInterface(config=config, settings=settings)
-            r = tmp_iface._post_v1(
-                self.settings.url_start,  # create-run
-                tmp_iface.headers,
-                make_compat_start_v1(
-                    self.config, self.settings, self.settings._sys.get_info()
-                ),
-                client=tmp_iface.client_api,
-            )
-            self.settings.url_view = r.json()["url"]
-            self.settings._op_id = r.json()["runId"]
-            logger.info(f"{tag}: started run {str(self.settings._op_id)}")
+            if self.settings.offline:  # recorded in the store for `mlop sync`
+                self.settings.disable_store = False
+            else:
+                tmp_iface = ServerInterface(config=config, settings=settings)
+                r = tmp_iface._post_v1(
+                    self.settings.url_start,  # create-run
+                    tmp_iface.headers,
+                    make_compat_start_v1(
+                        self.config, self.settings, self.settings._sys.get_info()
+                    ),
+                    client=tmp_iface.client_api,
+                )
+                self.settings.url_view = r.json()["url"]
+                self.settings._op_id = r.json()["runId"]
+                logger.info(f"{tag}: started run {str(self.settings._op_id)}")
 
             os.makedirs(f"{self.settings.get_dir()}/files", exist_ok=True)
+            self.settings.message = Buffer(
+                self.settings, "message", policy="drop"
+            )  # never block console output
             setup_logger(
                 settings=self.settings,
                 logger=logger,
@@ -131,20 +147,42 @@ class Op:
             if not settings.disable_store
             else None
         )
-        self._iface = (
-            ServerInterface(config=config, settings=settings)
-            if not settings.disable_iface
-            else None
-        )
+        if settings.disable_iface:
+            self._iface = None
+        elif settings.offline:
+            self._iface = OfflineInterface(
+                config=config, settings=settings, store=self._store
+            )
+            self._store.record(
+                "start",
+                make_compat_start_v1(
+                    self.config, self.settings, self.settings._sys.get_info()
+                ),
+            )
+        else:
+            self._iface = (
+                AsyncServerInterface
+                if settings.x_internal_engine == "async"
+                else ServerInterface
+            )(config=config, settings=settings)
+        self.settings.meta = Registry()
         self._step = 0
-        self._queue = queue.Queue()
+        self._queue = Buffer(settings, "op")
+        self._commit = None  # pending (data, step) merged across commit=False calls
+        self._lock_commit = threading.Lock()
+        self._reducers = {}  # name -> Reducer, or None when not reduced
+        BUDGET.configure(settings)  # process-wide, set by the latest live run
+        self._media = get_executor(settings)
+        self._loading = {}  # file -> future of its loaded file, within one batch
+        self._media_stats = {}
         atexit.register(self.finish)
 
     def start(self) -> None:
         self._iface.start() if self._iface else None
-        self._iface._update_meta(
-            list(make_compat_monitor_v1(self.settings._sys.monitor()).keys())
-        ) if self._iface else None
+        nm, fm = [], {}
+        for k in make_compat_monitor_v1(self.settings._sys.monitor()).keys():
+            self._m(nm, fm, k, 0.0)
+        self._iface._update_meta(num=nm) if nm and self._iface else None
         self._monitor.start()
         logger.debug(f"{tag}: started")
 
@@ -160,20 +198,89 @@ class Op:
         step: Union[int, None] = None,
         commit: Union[bool, None] = None,
     ) -> None:
-        """Log run data"""
+        """Log run data; commit=False merges calls into one record per step"""
+        with self._lock_commit:
+            if self._commit is not None and step != self._commit[1]:
+                self._put(*self._commit)
+                self._commit = None
+            if commit is False or self._commit is not None:
+                if not isinstance(data, Mapping):
+                    self._put(data, step)  # fail validation in _log
+                    return
+                if self._commit is None:
+                    self._commit = ({}, step)
+                self._commit[0].update(data)
+                if commit is False:
+                    return
+                data, self._commit = self._commit[0], None
+            self._put(data, step)
+
+    def log_batch(
+        self,
+        keys: List[str],
+        steps: Union[Any, None] = None,
+        values: Any = None,
+        timestamps: Union[Any, float, None] = None,
+    ) -> None:
+        """Log a block of numeric values with one row per step and one column per key"""
+        if isinstance(keys, str):
+            keys = [keys]
+        if any(not isinstance(k, str) for k in keys):
+            e = ValueError("unsupported type for key in logged batch")
+            logger.critical("%s: failed: %s", tag, e)
+            raise e
+
+        values = get_array(values)
+        if values.ndim == 1:
+            values = values.reshape((-1, 1) if len(keys) == 1 else (1, -1))
+        if values.ndim != 2 or values.shape[1] != len(keys):
+            e = ValueError(
+                f"unsupported shape for logged batch: {values.shape}, expected (steps, {len(keys)})"
+            )
+            logger.critical("%s: failed: %s", tag, e)
+            raise e
+        if steps is not None:
+            steps = get_array(steps).astype("int64").reshape(-1)
+        if timestamps is not None:
+            timestamps = get_array(timestamps).reshape(-1)
+            if len(timestamps) == 1:
+                timestamps = timestamps.repeat(len(values))
+        if any(a is not None and len(a) != len(values) for a in [steps, timestamps]):
+            e = ValueError(
+                f"unsupported length for steps or timestamps of logged batch, expected {len(values)}"
+            )
+            logger.critical("%s: failed: %s", tag, e)
+            raise e
+
         if self.settings.mode == "perf":
-            self._queue.put((data, step), block=False)
+            self._queue.put((list(keys), steps, values, timestamps))
         else:  # bypass queue
-            self._log(data=data, step=step)
+            self._log_batch(list(keys), steps, values, timestamps)
 
     def finish(self, code: Union[int, None] = None) -> None:
         """Finish logging"""
+        if self not in (mlop.ops or []):
+            return  # already finished, e.g. again at exit
         try:
+            with self._lock_commit:
+                if self._commit is not None:
+                    self._put(*self._commit)
+                    self._commit = None
             self._monitor.stop(code)
             while not self._queue.empty():
                 time.sleep(self.settings.x_internal_check_process)
-            self._store.stop() if self._store else None
-            self._iface.stop() if self._iface else None  # fixed order
+            self._flush_reduce()  # publish partial windows
+            self._media.shutdown() if self._media else None
+            log_stats(self._media_stats)
+            logger.debug(f"{tag}: media budget {BUDGET.stats()}")
+            logger.debug(f"{tag}: queue {self._queue.stats()}")
+            self._queue.close()
+            if self.settings.offline:  # the interface records into the store
+                self._iface.stop() if self._iface else None
+                self._store.stop() if self._store else None
+            else:
+                self._store.stop() if self._store else None
+                self._iface.stop() if self._iface else None  # fixed order
         except (Exception, KeyboardInterrupt) as e:
             self.settings._op_status = signal.SIGINT.value
             self._iface._update_status(
@@ -197,10 +304,9 @@ class Op:
         logger.debug(f"{tag}: finished")
         teardown_logger(logger, console=logging.getLogger("console"))
 
-        self.settings.meta = []
-        mlop.ops = [
-            op for op in mlop.ops if op.settings._op_id != self.settings._op_id
-        ]  # TODO: make more efficient
+        self.settings.meta = Registry()
+        BUDGET.remove(self.settings)
+        mlop.ops = [op for op in mlop.ops if op is not self]  # offline runs have no id
 
     def watch(self, module, **kwargs):
         from .compat.torch import _watch_torch
@@ -252,31 +358,55 @@ class Op:
                 client=self._iface.client,
             ) if self._iface else None
         else:
-            self._iface._post_v1(
+            self._iface._post_webhook(
                 url,
-                {"Content-Type": "application/json"},
                 make_compat_webhook_v1(
                     t, level, title, message, self._step, self.settings.url_view
                 ),
-                self._iface.client,  # TODO: check client
             ) if self._iface else logger.warning(
                 f"{tag}: alert not sent since interface is disabled"
             )
 
+    def _put(self, data, step) -> None:
+        if self.settings.mode == "perf":
+            self._queue.put((data, step))
+        else:  # bypass queue
+            try:
+                self._log(data=get_tensors([data])[0], step=step)
+            finally:
+                self._unload()
+
     def _worker(self, stop) -> None:
         while not stop() or not self._queue.empty():
             try:
                 # if queue seems empty, wait for x_internal_check_process before it considers it empty to save compute
-                self._log(
-                    *self._queue.get(
+                b = [
+                    self._queue.get(
                         block=True, timeout=self.settings.x_internal_check_process
                     )
-                )
+                ]
             except queue.Empty:
                 continue
+            while len(b) < self.settings.x_internal_batch_size:
+                try:
+                    b.append(self._queue.get(block=False))
+                except queue.Empty:
+                    break
+
+            try:  # one device-to-host transfer for tensors across all pending calls
+                d = get_tensors([i[0] for i in b if len(i) != 4])
+                b = [i if len(i) == 4 else (d.pop(0), *i[1:]) for i in b]
             except Exception as e:
-                time.sleep(self.settings.x_internal_check_process)  # debounce
-                logger.critical("%s: failed: %s", tag, e)
+                logger.debug("%s: failed to batch tensors: %s", tag, e)
+            for i in b:  # encode files of all pending calls in parallel
+                self._prefetch(i[0]) if len(i) != 4 else None
+            for i in b:
+                try:
+                    self._log_batch(*i) if len(i) == 4 else self._log(*i)
+                except Exception as e:
+                    time.sleep(self.settings.x_internal_check_process)  # debounce
+                    logger.critical("%s: failed: %s", tag, e)
+            self._unload()
 
     def _log(self, data, step: Union[int, None], t: Union[float, None] = None) -> None:
         if not isinstance(data, Mapping):
@@ -292,54 +422,168 @@ class Op:
 
         self._step = self._step + 1 if step is None else step
         t = time.time() if t is None else t
+        self._prefetch(data)
 
         # data = data.copy()  # TODO: check mutability
         n, d, f, nm, fm = {}, {}, {}, [], {}
+        meta = self.settings.meta
+        if all(type(v) is float or type(v) is int for v in data.values()):
+            for k, v in data.items():  # fast path for builtin scalars
+                n[(meta.get(k) or self._m(nm, fm, k, v))["name"]] = v if v == v else 0
+            data = {}
         for k, v in data.items():
-            k = get_char(k)  # TODO: remove validation
+            e = meta.get(k)
+            if e is None:
+                e = self._m(nm, fm, k, v[0] if isinstance(v, list) else v)
+            k = e["name"]
 
             if isinstance(v, list):
-                nm, fm = self._m(nm, fm, k, v[0])
                 for e in v:
                     n, d, f = self._op(n, d, f, k, e)
             else:
-                nm, fm = self._m(nm, fm, k, v)
                 n, d, f = self._op(n, d, f, k, v)
 
+        p = self._reduce(n, nm, fm) if self.settings.reduce else n
+
         # d = dict_to_json(d)  # TODO: add serialisation
         self._store.insert(
-            num=n, data=d, file=f, timestamp=t, step=self._step
+            num=p if self.settings.reduce_store else n,
+            data=d,
+            file=f,
+            timestamp=t,
+            step=self._step,
         ) if self._store else None
         self._iface.publish(
-            num=n, data=d, file=f, timestamp=t, step=self._step
+            num=p, data=d, file=f, timestamp=t, step=self._step
         ) if self._iface else None
         self._iface._update_meta(num=nm, df=fm) if (nm or fm) and self._iface else None
 
-    def _m(self, nm, fm, k, v) -> None:
-        if k not in self.settings.meta:
-            if isinstance(v, File) or isinstance(v, Data):
+    def _log_batch(self, keys, steps, values, timestamps) -> None:
+        if steps is None:
+            steps = np.arange(self._step + 1, self._step + 1 + len(values))
+        if timestamps is None:
+            timestamps = np.full(len(values), time.time())
+        if len(values) == 0:
+            return
+        self._step = int(steps[-1])
+
+        nm, fm, meta = [], {}, self.settings.meta
+        keys = [(meta.get(k) or self._m(nm, fm, k, 0.0))["name"] for k in keys]
+
+        pk, pv, r = keys, values, {}  # passed through, reduced values by row
+        if self.settings.reduce:
+            c = []
+            for j, k in enumerate(keys):
+                reducer = self._reducer(nm, fm, k)
+                if reducer is None:
+                    c.append(j)
+                    continue
+                for i, o in zip(*reducer.update_batch(values[:, j])):
+                    r.setdefault(i, {}).update(o)
+            if len(c) != len(keys):
+                pk, pv = [keys[j] for j in c], values[:, c]
+
+        if self._store and self.settings.reduce_store:
+            self._store.insert_batch(pk, steps, pv, timestamps) if pk else None
+            for i in sorted(r):
+                self._store.insert(
+                    num=r[i],
+                    data={},
+                    file={},
+                    timestamp=float(timestamps[i]),
+                    step=int(steps[i]),
+                )
+        elif self._store:
+            self._store.insert_batch(keys, steps, values, timestamps)
+        if self._iface:
+            self._iface.publish_batch(pk, steps, pv, timestamps) if pk else None
+            for i in sorted(r):
+                self._iface.publish(
+                    num=r[i], timestamp=float(timestamps[i]), step=int(steps[i])
+                )
+        self._iface._update_meta(num=nm, df=fm) if nm and self._iface else None
+
+    def _reduce(self, n, nm, fm) -> Dict[str, Any]:
+        p = {}
+        for k, v in n.items():
+            r = self._reducer(nm, fm, k)
+            if r is None:
+                p[k] = v
+            else:
+                o = r.update(v)
+                p.update(o) if o else None
+        return p
+
+    def _reducer(self, nm, fm, k):
+        if k not in self._reducers:  # resolve once per key
+            r = self._reducers[k] = make_reducer(k, self.settings)
+            for name in r.names[1:] if r else []:
+                self._m(nm, fm, name, 0.0)
+        return self._reducers[k]
+
+    def _flush_reduce(self) -> None:
+        p = {}
+        for r in self._reducers.values():
+            o = r.flush() if r else None
+            p.update(o) if o else None
+        if p:
+            t = time.time()
+            self._store.insert(
+                num=p, data={}, file={}, timestamp=t, step=self._step
+            ) if self._store and self.settings.reduce_store else None
+            self._iface.publish(
+                num=p, timestamp=t, step=self._step
+            ) if self._iface else None
+
+    def _m(self, nm, fm, k, v) -> Dict[str, Any]:
+        if isinstance(v, File):
+            kind = "file"
+        elif isinstance(v, Data):
+            kind = "data"
+        else:
+            kind = "num"
+        e, new = self.settings.meta.add(k, kind, self._step)
+        if new:
+            if kind == "num":
+                nm.append(e["name"])
+            else:
                 if v.__class__.__name__ not in fm:
                     fm[v.__class__.__name__] = []
-                fm[v.__class__.__name__].append(k)
-            elif isinstance(v, (int, float)) or v.__class__.__name__ == "Tensor":
-                nm.append(k)
-            self.settings.meta.append(k)
-            # d[f"{self.settings.x_meta_label}{k}"] = 0
-            logger.debug(f"{tag}: added {k} at step {self._step}")
-        return nm, fm
+                fm[v.__class__.__name__].append(e["name"])
+            logger.debug(f"{tag}: added {e['name']} at step {self._step}")
+        return e
+
+    def _prefetch(self, data) -> None:
+        for f in get_files(data):
+            BUDGET.enqueue(f)  # logged, so encoding will free its raw bytes
+            if self._media is not None and f not in self._loading:
+                self._loading[f] = self._media.submit(f)
+
+    def _unload(self) -> None:
+        for r in self._loading.values():  # files of calls that failed validation
+            r.cancel()
+        self._loading.clear()
+
+    def _load(self, v) -> File:
+        r = self._loading.pop(v, None)  # submitted in order, awaited in order
+        if r is not None:
+            r = r.result()
+        else:
+            r = load(
+                v,
+                self.settings.get_dir(),
+                self.settings.x_file_blob,
+                get_opts(self.settings),
+            )
+        release(v)  # a copy was encoded in another process
+        add_stats(self._media_stats, r)
+        return r
 
     def _op(self, n, d, f, k, v) -> None:
         if isinstance(v, File):
-            if (
-                isinstance(v, Artifact)
-                or isinstance(v, Text)
-                or isinstance(v, Image)
-                or isinstance(v, Audio)
-                or isinstance(v, Video)
-            ):
-                v.load(self.settings.get_dir())
-            # TODO: add step to serialise data for files
-            v._mkcopy(self.settings.get_dir())  # key independent
+            if getattr(v, "_dropped", False):  # over the media budget
+                return n, d, f
+            v = self._load(v)
             # d[k] = int(v._id, 16)
             if k not in f:
                 f[k] = []
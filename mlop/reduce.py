@@ -0,0 +1,98 @@
+import fnmatch
+import logging
+from typing import Dict, List, Union
+
+import numpy as np
+
+from .sets import Settings
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Reduce"
+
+OPS = {
+    "mean": np.mean,
+    "sum": np.sum,
+    "min": np.min,
+    "max": np.max,
+    "last": lambda a, axis=None: a[..., -1] if axis is not None else a[-1],
+}
+
+
+class Reducer:
+    """Windowed reduction of one key; the first op keeps the key name, others publish as key/op"""
+
+    def __init__(self, name: str, ops: List[str], window: int) -> None:
+        self.name = name
+        self.ops = [o for o in ops if o in OPS]
+        if len(self.ops) != len(ops):
+            logger.warning(
+                f"{tag}: unsupported reducer in {ops} for {name}, expected any of {list(OPS)}"
+            )
+        self.ops = self.ops or ["last"]
+        self.window = max(1, window)
+        self.names = [name] + [f"{name}/{o}" for o in self.ops[1:]]
+        self._reset()
+
+    def update(self, v: float) -> Union[Dict[str, float], None]:
+        if self.n == 0:
+            self.min = self.max = v
+        self.n += 1
+        self.sum += v
+        self.min = v if v < self.min else self.min
+        self.max = v if v > self.max else self.max
+        self.last = v
+        if self.n >= self.window:
+            return self.flush()
+        return None
+
+    def update_batch(self, v: np.ndarray):
+        # returns indices into v where windows closed and the reduced values at each
+        i, o = [], []
+        r = min(self.window - self.n, len(v))
+        for e in v[:r].tolist():  # complete the pending window
+            out = self.update(e)
+        if self.n == 0 and r:
+            i.append(r - 1)
+            o.append([out[k] for k in self.names])
+
+        full = (len(v) - r) // self.window
+        if full:
+            b = v[r : r + full * self.window].reshape(full, self.window)
+            i.extend((r - 1 + self.window * np.arange(1, full + 1)).tolist())
+            o.extend(np.stack([OPS[op](b, axis=1) for op in self.ops], axis=1).tolist())
+        for e in v[r + full * self.window :].tolist():
+            self.update(e)
+        return i, [dict(zip(self.names, e)) for e in o]
+
+    def flush(self) -> Union[Dict[str, float], None]:
+        if self.n == 0:
+            return None
+        r = {
+            "mean": self.sum / self.n,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+        }
+        self._reset()
+        return {k: r[op] for k, op in zip(self.names, self.ops)}
+
+    def _reset(self) -> None:
+        self.n, self.sum, self.min, self.max, self.last = 0, 0.0, None, None, None
+
+
+def make_reducer(name: str, settings: Settings) -> Union[Reducer, None]:
+    spec = settings.reduce.get(name)
+    if spec is None:
+        spec = next(
+            (s for p, s in settings.reduce.items() if fnmatch.fnmatchcase(name, p)),
+            None,
+        )
+    if spec is None:
+        return None
+    ops, _, window = spec.partition(":")
+    return Reducer(
+        name,
+        [o.strip() for o in ops.split("+")],
+        int(window) if window else settings.x_reduce_window,
+    )
@@ -23,6 +23,7 @@ class Settings:
     disable_iface: bool = False
     disable_progress: bool = True
     disable_console: bool = False  # disable file-based logging
+    offline: bool = False  # record to the run directory for `mlop sync`
 
     _op_name: str = None
     _op_id: int = None
@@ -31,8 +32,18 @@ class Settings:
     store_db: str = "store.db"
     store_table_num: str = "num"
     store_table_file: str = "file"
+    store_table_record: str = "record"
+    store_table_key: str = "key"
+    store_table_data: str = "data"
     store_max_size: int = 2**14
     store_aggregate_interval: float = 2 ** (-1)
+    store_synchronous: str = "NORMAL"  # OFF | NORMAL | FULL | EXTRA
+    store_cache_size: int = -(2**16)  # pages, or KiB when negative
+    store_page_size: int = 2**12  # applies to new databases
+    store_mmap_size: int = 2**28
+
+    reduce: Dict[str, str] = {}  # key or glob -> "mean:100" | "last+min+max:10"
+    reduce_store: bool = False  # store reduced values instead of full resolution
 
     http_proxy: str = None
     https_proxy: str = None
@@ -40,13 +51,42 @@ class Settings:
 
     x_log_level: int = 2**4  # logging.NOTSET
     x_internal_check_process: int = 1  # TODO: make configurable
+    x_internal_batch_size: int = 2**10
+    x_internal_engine: str = "thread"  # thread | async
+    x_queue_max_size: int = 2**16  # 0 for unbounded
+    x_queue_max_bytes: int = 2**28
+    x_queue_policy: str = "block"  # block | drop | sample | spill
+    x_reduce_window: int = 2**7
     x_file_stream_retry_max: int = 2**2
     x_file_stream_retry_wait_min_seconds: float = 2 ** (-1)
     x_file_stream_retry_wait_max_seconds: float = 2
     x_file_stream_timeout_seconds: int = 2**5  # 2**2
     x_file_stream_max_conn: int = 2**5
+    x_file_stream_join_timeout_seconds: int = 2**7
     x_file_stream_max_size: int = 2**18
+    x_file_stream_chunk_size: int = 2**20
+    x_file_stream_multipart: bool = False  # needs a store that assembles ranged puts
+    x_file_stream_part_size: int = 2**26  # larger files upload in resumable parts
+    x_file_stream_part_conn: int = 2**2  # parallel parts per file
+    x_image_format: str = "png"  # png | webp | jpeg
+    x_image_quality: int = None  # webp and jpeg; format default when unset
+    x_image_compress_level: int = None  # png zlib level, webp method
+    x_image_max_size: int = None  # longest edge in pixels, downscaled to fit
+    x_audio_format: str = "wav"  # wav | flac | ogg | opus
+    x_audio_compression_level: float = None  # 0 to 1 for flac, ogg and opus
+    x_media_executor: str = "thread"  # thread | process | None to encode inline
+    x_media_workers: int = None  # cpu count up to 32
+    x_media_max_bytes: int = 2**28  # media held in flight
+    x_media_budget_bytes: int = 2**30  # raw media held before encoding, 0 to disable
+    x_media_budget_policy: str = "stage"  # block | drop | stage to disk over budget
+    x_media_budget_timeout_seconds: float = 2**4  # block before staging
+    x_file_blob: bool = True  # share logged files across runs through ~/.mlop/blobs
+    x_file_stream_resume: bool = False  # resume interrupted multipart uploads
     x_file_stream_transmit_interval: int = 2**3
+    x_file_stream_compression: str = None  # gzip | zstd
+    x_file_stream_compression_level: int = None  # backend default
+    x_file_stream_compression_min_size: int = 2**10
+    x_sync_batch_bytes: int = 2**24  # bytes per request when syncing offline runs
     x_sys_sampling_interval: int = 2**2
     x_sys_label: str = "sys"
     x_grad_label: str = "grad"
@@ -148,7 +188,6 @@ def get_console() -> str:
 
 
 def setup(settings: Union[Settings, Dict[str, Any], None] = None) -> None:
-    if not isinstance(settings, Settings):
-        settings = Settings()
-    settings.update(settings)
-    return settings
+    s = settings if isinstance(settings, Settings) else Settings()
+    s.update(settings or {})  # a dict of overrides applies to fresh settings
+    return s
@@ -1,14 +1,23 @@
+import json
 import logging
 import queue
 import sqlite3
 import threading
 import time
+import zlib
 
+import numpy as np
+
+from .api import dumps
+from .buffer import Buffer
 from .sets import Settings
 
 logger = logging.getLogger(f"{__name__.split('.')[0]}")
 tag = "Store"
 
+SCHEMA = 2  # user_version of the table layout
+SYNCHRONOUS = ["OFF", "NORMAL", "FULL", "EXTRA"]
+
 
 class DataStore:
     def __init__(self, config: dict, settings: Settings) -> None:
@@ -16,121 +25,301 @@ class DataStore:
 
         self.db = f"{settings.get_dir()}/{settings.store_db}"
 
-        self.conn = sqlite3.connect(
-            self.db, check_same_thread=False
-        )  # isolation_level=None
-        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn = get_conn(self.db, settings)  # owned by the writer once started
         self.cursor = self.conn.cursor()
+        self._reader = None  # opened on the first query
+        self._sql = {
+            "num": f"INSERT OR REPLACE INTO {settings.store_table_num} (key_id, step, time, value) VALUES (?, ?, ?, ?)",
+            "data": f"INSERT OR REPLACE INTO {settings.store_table_data} (key_id, step, time, i, type, value) VALUES (?, ?, ?, ?, ?, ?)",
+            "file": f"INSERT OR REPLACE INTO {settings.store_table_file} (key_id, step, time, name, hash) VALUES (?, ?, ?, ?, ?)",
+            "record": f"INSERT INTO {settings.store_table_record} (time, kind, key, body) VALUES (?, ?, ?, ?)",
+            "key": f"INSERT OR IGNORE INTO {settings.store_table_key} (name) VALUES (?)",
+            "query": f"SELECT step, time, value FROM {settings.store_table_num} WHERE key_id = ? AND step BETWEEN ? AND ?",
+        }  # fixed strings are prepared once in the statement cache of each connection
 
         self._stop_event = threading.Event()
         self._lock = threading.Lock()
-        self._queue = queue.Queue()
+        self._queue = Buffer(
+            settings,
+            "store",
+            policy="block"
+            if settings.offline and settings.x_queue_policy in ["drop", "sample"]
+            else None,
+        )  # records of offline runs are what `mlop sync` uploads, so never lossy
         self._thread = None
+        self._keys = {}  # name -> id in the key table
+        self._commits, self._rows = 0, 0
         self.start()
 
     def start(self):
         if self._thread is None:
+            self._migrate()
+            self._create()
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA};")
+            self.conn.commit()
+            self._keys = dict(
+                self.cursor.execute(
+                    f"SELECT name, id FROM {self.settings.store_table_key}"
+                )
+            )
+            self._stop_event.clear()
             self._thread = threading.Thread(target=self._worker, daemon=True)
             self._thread.start()
 
+    def _create(self):
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.settings.store_table_key}(
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+        """)
         self.cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS {self.settings.store_table_num}(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                time INTEGER NOT NULL,
+                key_id INTEGER NOT NULL,
                 step INTEGER NOT NULL,
-                key TEXT NOT NULL,
-                value REAL NOT NULL
-            );
+                time REAL NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (key_id, step, time)
+            ) WITHOUT ROWID;
+        """)
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.settings.store_table_data}(
+                key_id INTEGER NOT NULL,
+                step INTEGER NOT NULL,
+                time REAL NOT NULL,
+                i INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                value BLOB NOT NULL,
+                PRIMARY KEY (key_id, step, time, i)
+            ) WITHOUT ROWID;
         """)
         self.cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS {self.settings.store_table_file}(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                time INTEGER NOT NULL,
+                key_id INTEGER NOT NULL,
                 step INTEGER NOT NULL,
+                time REAL NOT NULL,
                 name TEXT NOT NULL,
-                aid REAL NOT NULL
+                hash TEXT NOT NULL,
+                PRIMARY KEY (key_id, step, time, name)
+            ) WITHOUT ROWID;
+        """)
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.settings.store_table_record}(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                time REAL NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT,
+                body BLOB NOT NULL
             );
         """)
-        self.conn.commit()
+
+    def _migrate(self):
+        # v1 kept the full key in every row of unindexed tables and no payloads
+        version = self.cursor.execute("PRAGMA user_version;").fetchone()[0]
+        num, file, key = (
+            self.settings.store_table_num,
+            self.settings.store_table_file,
+            self.settings.store_table_key,
+        )
+        cols = [r[1] for r in self.cursor.execute(f"PRAGMA table_info({num});")]
+        if version >= SCHEMA or "key" not in cols:
+            return
+
+        s = time.time()
+        self.conn.execute("BEGIN")
+        try:
+            self.cursor.execute(f"ALTER TABLE {num} RENAME TO {num}_v1;")
+            self.cursor.execute(f"ALTER TABLE {file} RENAME TO {file}_v1;")
+            self._create()
+            self.cursor.execute(
+                f"INSERT OR IGNORE INTO {key} (name) SELECT DISTINCT key FROM {num}_v1;"
+            )
+            self.cursor.execute(f"""
+                INSERT OR REPLACE INTO {num} (key_id, step, time, value)
+                SELECT k.id, n.step, n.time, n.value FROM {num}_v1 n
+                JOIN {key} k ON k.name = n.key ORDER BY k.id, n.step;
+            """)  # in clustered order
+            n = self.cursor.rowcount
+            self.cursor.execute(f"INSERT OR IGNORE INTO {key} (name) VALUES ('');")
+            self.cursor.execute(f"""
+                INSERT OR REPLACE INTO {file} (key_id, step, time, name, hash)
+                SELECT k.id, f.step, f.time, f.name, CAST(f.aid AS TEXT)
+                FROM {file}_v1 f JOIN {key} k ON k.name = '';
+            """)  # v1 did not record the log name of files
+            self.cursor.execute(f"DROP TABLE {num}_v1;")
+            self.cursor.execute(f"DROP TABLE {file}_v1;")
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA};")
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.critical("%s: failed to migrate %s: %s", tag, self.db, e)
+            raise e
+        self.conn.execute("VACUUM;")  # return the pages of the v1 tables
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")  # shrink the file now
+        logger.info(
+            f"{tag}: migrated {n} point(s) from schema v{version or 1} to v{SCHEMA} in {time.time() - s:.2f}s"
+        )
 
     def insert(self, num=None, data=None, file=None, timestamp=None, step=None):
-        self._queue.put((num, data, file, timestamp, step))
+        self._queue.put(("point", num, data, file, timestamp, step))
+
+    def insert_batch(self, keys, steps, values, timestamps):
+        self._queue.put(("batch", keys, steps, values, timestamps))
+
+    def record(self, kind, body, key=None):
+        # a request the interface would have sent, replayed by `mlop sync`
+        self._queue.put(("record", time.time(), kind, key, body))
 
     def stop(self):
-        while not self._queue.empty():
-            pass
-        self._stop_event.set()
+        self._stop_event.set()  # the writer drains the queue before it exits
         if self._thread is not None:
-            self._thread.join(timeout=None)  # TODO: investigate hanging
+            self._thread.join(timeout=None)
             self._thread = None
-        self.conn.commit()
+        logger.debug(f"{tag}: queue {self._queue.stats()}")
+        logger.debug(f"{tag}: wrote {self._rows} row(s) in {self._commits} commit(s)")
+        self._queue.close()
         self.conn.close()
+        if self._reader is not None:
+            self._reader.close()
         logger.info(f"{tag}: find saved database at {self.db}")
 
+    def query(self, key, start=None, stop=None):
+        """Points of a key as (step, time, value), optionally within a range of steps"""
+        i = self._keys.get(key)
+        if i is None:
+            return []
+        with self._lock:
+            if self._reader is None:  # never waits on the writer in wal mode
+                self._reader = get_conn(self.db, self.settings)
+            return self._reader.execute(
+                self._sql["query"],
+                (
+                    i,
+                    -(2**63) if start is None else start,
+                    2**63 - 1 if stop is None else stop,
+                ),
+            ).fetchall()
+
     def _worker(self):
-        while not self._stop_event.is_set():
-            batch_num, batch_file = [], []
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch_num, batch_data, batch_file, batch_record = [], [], [], []
             start = time.time()
             while (
                 time.time() - start < self.settings.store_aggregate_interval
                 and len(batch_num) < self.settings.store_max_size
                 and len(batch_file) < self.settings.store_max_size
             ):
-                try:  # TODO: add data support
-                    n, d, f, t, s = self._queue.get(
+                try:
+                    i = self._queue.get(
                         timeout=max(
                             0,
                             self.settings.store_aggregate_interval
                             - (time.time() - start),
                         )
                     )
-                    if n != {}:
-                        batch_num.append(
-                            {
-                                "t": t,
-                                "s": s,
-                                "n": n,
-                            }
-                        )
-                    if f != {}:
-                        batch_file.append(
-                            {
-                                "t": t,
-                                "s": s,
-                                "f": f,
-                            }
-                        )
                 except queue.Empty:
+                    if self._stop_event.is_set():
+                        break
                     continue
-            self._insert(batch_num, batch_file)
-
-    def _insert(self, d, f):
-        with self._lock:
-            self.conn.execute("BEGIN")
-            try:
-                if d != []:
-                    self.cursor.executemany(
-                        f"""
-                        INSERT INTO {self.settings.store_table_num} (time, step, key, value) VALUES (?, ?, ?, ?)
-                        """,
-                        [(e["t"], e["s"], k, v) for e in d for k, v in e["n"].items()],
+                if i[0] == "batch":
+                    _, k, s, v, t = i
+                    batch_num.extend(
+                        zip(
+                            np.repeat(t, len(k)).tolist(),
+                            np.repeat(s, len(k)).tolist(),
+                            k * len(s),
+                            v.ravel().tolist(),
+                        )
                     )
-                    logger.info(f"{tag}: inserted {len(d)} line(s)")
-                if f != []:
-                    self.cursor.executemany(
-                        f"""
-                        INSERT INTO {self.settings.store_table_file} (time, step, name, aid) VALUES (?, ?, ?, ?)
-                        """,
-                        [
-                            (e["t"], e["s"], f"{fe._name}{fe._ext}", fe._id)
-                            for e in f
-                            # for fe in e["f"].values()
-                            for fel in e["f"].values()
+                elif i[0] == "record":
+                    batch_record.append(i[1:])
+                else:
+                    _, n, d, f, t, s = i
+                    if n:
+                        batch_num.extend((t, s, k, v) for k, v in n.items())
+                    if d:
+                        batch_data.extend(
+                            (t, s, k, j, e)
+                            for k, dl in d.items()
+                            for j, e in enumerate(dl)
+                        )
+                    if f:
+                        batch_file.extend(
+                            (t, s, k, f"{fe._name}{fe._ext}", fe._id)
+                            for k, fel in f.items()
                             for fe in fel
-                        ],
-                    )
-                    logger.info(f"{tag}: inserted {len(f)} file(s)")
-                self.conn.commit()
-            except Exception as e:
-                self.conn.rollback()
-                logger.error("%s: failed to insert batch: %s", tag, e)
+                        )
+            if batch_num or batch_data or batch_file or batch_record:
+                self._insert(batch_num, batch_data, batch_file, batch_record)
+
+    def _insert(self, d, data, f, r):
+        self.conn.execute("BEGIN")
+        try:
+            ids = self._ids(
+                {e[2] for e in d} | {e[2] for e in data} | {e[2] for e in f}
+            )
+            if d != []:
+                self.cursor.executemany(
+                    self._sql["num"], [(ids[k], s, t, v) for t, s, k, v in d]
+                )
+            if data != []:
+                self.cursor.executemany(
+                    self._sql["data"],
+                    [
+                        (ids[k], s, t, j, type(e).__name__, get_blob(e))
+                        for t, s, k, j, e in data
+                    ],
+                )
+            if f != []:
+                self.cursor.executemany(
+                    self._sql["file"],
+                    [(ids[k], s, t, name, h) for t, s, k, name, h in f],
+                )
+            if r != []:
+                self.cursor.executemany(self._sql["record"], r)
+            self.conn.commit()
+            self._commits += 1
+            self._rows += len(d) + len(data) + len(f) + len(r)
+            logger.debug(
+                f"{tag}: inserted {len(d)} point(s), {len(data)} payload(s), {len(f)} file(s), {len(r)} record(s)"
+            )
+        except Exception as e:
+            self.conn.rollback()
+            self._keys = {}  # ids of the rolled back keys are void
+            logger.error("%s: failed to insert batch: %s", tag, e)
+
+    def _ids(self, names):
+        new = [(k,) for k in names if k not in self._keys]
+        if new:
+            self.cursor.executemany(self._sql["key"], new)
+            self._keys = dict(
+                self.cursor.execute(
+                    f"SELECT name, id FROM {self.settings.store_table_key}"
+                )
+            )
+        return self._keys
+
+
+def get_blob(d) -> bytes:
+    # payloads of histograms and tables as compressed json
+    return zlib.compress(dumps(d.to_dict()), 1)
+
+
+def get_data(b: bytes) -> dict:
+    return json.loads(zlib.decompress(b))
+
+
+def get_conn(path, settings: Settings) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=2**7)
+    conn.execute(f"PRAGMA page_size = {int(settings.store_page_size)};")  # new files
+    conn.execute("PRAGMA journal_mode=WAL;")
+    sync = str(settings.store_synchronous).upper()
+    if sync not in SYNCHRONOUS:
+        logger.warning(
+            f"{tag}: unsupported synchronous {sync}, expected one of {SYNCHRONOUS}: proceeding with NORMAL"
+        )
+        sync = "NORMAL"
+    conn.execute(f"PRAGMA synchronous = {sync};")  # normal syncs wal on checkpoint only
+    conn.execute(f"PRAGMA cache_size = {int(settings.store_cache_size)};")
+    conn.execute(f"PRAGMA mmap_size = {int(settings.store_mmap_size)};")
+    return conn
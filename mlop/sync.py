@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import queue
+import signal
+import sqlite3
+import time
+import types
+from typing import Union
+
+from .api import dumps, make_compat_status_v1
+from .auth import login
+from .iface import ServerInterface
+from .sets import Settings, setup
+from .util import print_url
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Sync"
+
+LINES = ["num", "data", "message"]  # ndjson bodies that concatenate into one request
+
+
+class OfflineInterface(ServerInterface):
+    """Records what the server interface would send into the DataStore of the run"""
+
+    def __init__(self, config: dict, settings: Settings, store) -> None:
+        super().__init__(config=config, settings=settings)
+        self._store = store
+        self._kinds = {
+            settings.url_num: "num",
+            settings.url_data: "data",
+            settings.url_message: "message",
+            settings.url_meta: "meta",
+            settings.url_graph: "graph",
+            settings.url_stop: "status",
+            settings.url_alert: "alert",
+        }
+
+    def start(self) -> None:
+        logger.info(
+            f"{tag}: recording offline at {print_url(self.settings.get_dir())}: upload later with `{self.settings.tag} sync {self.settings.get_dir()}`"
+        )
+        super().start()
+
+    def stop(self) -> None:
+        super().stop()
+        logger.info(f"{tag}: recorded {self._total} entries offline")
+
+    def _resume(self) -> None:
+        pass  # nothing was uploaded
+
+    def _post_v1(
+        self,
+        url,
+        headers,
+        q,
+        client,
+        name: Union[str, None] = "post",
+        compress: bool = False,
+    ):
+        b = []
+        content = b"".join(self._queue_iter(q, b)) if isinstance(q, queue.Queue) else q
+        kind = self._kinds.get(url)
+        if kind is None:  # e.g. trigger polls, which have no run to act on offline
+            logger.debug(f"{tag}: skipped recording request to {url}")
+            return None
+        self._store.record(kind, content)
+        return True
+
+    def _post_webhook(self, url, content):
+        self._store.record("webhook", content, key=url)  # posted as-is on sync
+        return True
+
+    def _worker_file(self, items):
+        dir = self.settings.get_dir()
+        self._store.record(
+            "file",
+            dumps(
+                [
+                    {
+                        "key": k,
+                        "name": f._name,
+                        "caption": getattr(f, "_caption", None),
+                        "ext": f._ext,
+                        "id": f._id,
+                        "path": os.path.relpath(f._path, dir),  # run dir may move
+                        "type": f._type,
+                        "time": timestamp,
+                        "step": step,
+                    }
+                    for file, timestamp, step in items
+                    for k, fel in file.items()
+                    for f in fel
+                ]
+            ),
+        )
+        return True
+
+
+def sync(dir: str, settings: Union[Settings, None] = None, force: bool = False) -> bool:
+    # replay the record of an offline run in large batches with parallel uploads
+    settings = setup(settings)
+    dir = os.path.abspath(dir)
+    db = os.path.join(dir, settings.store_db)
+    if not os.path.exists(db):
+        logger.error(f"{tag}: no offline record found at {db}")
+        return False
+    conn = sqlite3.connect(db, timeout=2**3)
+    table = settings.store_table_record
+    try:
+        start = conn.execute(
+            f"SELECT body FROM {table} WHERE kind = 'start' ORDER BY id LIMIT 1"
+        ).fetchone()
+        synced = conn.execute(
+            f"SELECT body FROM {table} WHERE kind = 'synced' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        logger.error(f"{tag}: {db} holds no offline record: {e}")
+        return False
+    if start is None:
+        logger.error(f"{tag}: {db} holds no offline record")
+        return False
+    if synced is not None and not force:
+        logger.warning(
+            f"{tag}: already synced to {print_url(json.loads(synced[0])['url'])}: pass --force to upload again"
+        )
+        return True
+
+    s = json.loads(start[0])
+    host = json.loads(s.get("loggerSettings") or "{}").get("host")
+    if settings.host is None and host:
+        settings.update({"host": host})  # the server the run was configured for
+    settings.project, settings._op_name = s["projectName"], s["runName"]
+    settings.dir = os.path.dirname(os.path.dirname(os.path.dirname(dir)))
+    login(settings=settings)
+
+    t = time.time()
+    tmp_iface = ServerInterface(config=None, settings=settings)
+    r = tmp_iface._post_v1(
+        settings.url_start, tmp_iface.headers, start[0], client=tmp_iface.client_api
+    )
+    tmp_iface._executor.shutdown(wait=False)
+    if r is None:
+        logger.error(f"{tag}: failed to create run {settings._op_name}")
+        return False
+    settings.url_view = r.json()["url"]
+    settings._op_id = r.json()["runId"]
+    iface = ServerInterface(config=None, settings=settings)  # headers name the run
+
+    urls = {
+        "num": settings.url_num,
+        "data": settings.url_data,
+        "message": settings.url_message,
+        "meta": settings.url_meta,
+        "graph": settings.url_graph,
+        "alert": settings.url_alert,
+    }
+    lines = {k: [] for k in LINES}
+    size = {k: 0 for k in LINES}
+    files, status, n, missing = [], None, 0, []
+
+    def flush(kind):
+        if lines[kind]:
+            iface._schedule(
+                kind,
+                kind,
+                iface._post_v1,
+                urls[kind],
+                iface.headers_num if kind == "num" else iface.headers,
+                b"".join(lines[kind]),
+                iface.client,
+                kind,
+                True,
+            )
+            lines[kind], size[kind] = [], 0
+
+    def flush_files():
+        if files:
+            iface._worker_file(list(files))  # storage uploads run on the executor
+            files.clear()
+
+    for kind, key, body in conn.execute(
+        f"SELECT kind, key, body FROM {table} ORDER BY id"
+    ):
+        n += 1
+        if kind in LINES:
+            lines[kind].append(body)
+            size[kind] += len(body)
+            if size[kind] >= settings.x_sync_batch_bytes:
+                flush(kind)
+        elif kind == "file":
+            for m in json.loads(body):
+                f = get_file(dir, m)
+                if f is None:
+                    missing.append(m["path"])
+                    continue
+                files.append(({m["key"]: [f]}, m["time"], m["step"]))
+            if len(files) >= settings.x_file_stream_max_size:
+                flush_files()
+        elif kind == "status":
+            status = body  # the last one stands
+        elif kind == "webhook":
+            iface._schedule(
+                kind,
+                key,
+                iface._post_v1,
+                key,
+                {"Content-Type": "application/json"},
+                body,
+                iface.client,
+            )
+        elif kind in urls:
+            iface._schedule(
+                kind,
+                kind,
+                iface._post_v1,
+                urls[kind],
+                iface.headers,
+                get_body(body, settings._op_id),
+                iface.client_api,
+            )
+    conn.close()
+    for k in LINES:
+        flush(k)
+    flush_files()
+    iface._join()
+
+    if status is None:  # the process never finished
+        logger.warning(f"{tag}: no final status recorded: marking run as terminated")
+        settings._op_status = signal.SIGINT.value
+        status = make_compat_status_v1(settings)
+    iface._post_v1(
+        settings.url_stop,
+        iface.headers,
+        get_body(status, settings._op_id),
+        client=iface.client_api,
+    )
+
+    for p in missing[:8]:
+        logger.error(f"{tag}: recorded file {p} no longer exists")
+    ok = not iface._failed and not missing
+    if ok:
+        conn = sqlite3.connect(db, timeout=2**3)
+        conn.execute(
+            f"INSERT INTO {table} (time, kind, key, body) VALUES (?, ?, ?, ?)",
+            (
+                time.time(),
+                "synced",
+                None,
+                dumps({"runId": settings._op_id, "url": settings.url_view}),
+            ),
+        )
+        conn.commit()
+        conn.close()
+    logger.info(
+        f"{tag}: uploaded {n} record(s) in {time.time() - t:.2f}s: find them at {print_url(settings.url_view)}"
+    )
+    return ok
+
+
+def get_body(body, run_id):
+    # requests recorded offline carry no run id until the server assigns one
+    d = json.loads(body)
+    if "runId" in d:
+        d["runId"] = run_id
+    return dumps(d)
+
+
+def get_file(dir, m) -> Union[types.SimpleNamespace, None]:
+    path = os.path.join(dir, m["path"])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return types.SimpleNamespace(
+        _name=m["name"],
+        _caption=m.get("caption"),
+        _ext=m["ext"],
+        _id=m["id"],
+        _path=path,
+        _type=m["type"],
+        _stat=stat,
+    )
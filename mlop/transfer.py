@@ -0,0 +1,265 @@
+import abc
+import concurrent.futures
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Tuple, Union
+
+import httpx
+import psutil
+
+from .sets import Settings
+
+logger = logging.getLogger(f"{__name__.split('.')[0]}")
+tag = "Transfer"
+
+ACTIVE = set()  # manifests being uploaded by this process
+_lock_active = threading.Lock()
+
+
+class Transfer(abc.ABC):
+    """Moves byte ranges of a local file to an object store; subclass for other stores"""
+
+    @abc.abstractmethod
+    def put_part(
+        self, url: str, path: str, offset: int, length: int, size: int, type: str
+    ) -> bool: ...
+
+    def complete(self, url: str, size: int, type: str) -> bool:
+        return True
+
+
+class HTTPTransfer(Transfer):
+    """Ranged PUTs against one storage url; only for stores that assemble parts by
+    Content-Range, as presigned S3 and GCS urls overwrite the object with each part"""
+
+    def __init__(self, client: httpx.Client, settings: Settings) -> None:
+        self.client = client
+        self.settings = settings
+
+    def put_part(self, url, path, offset, length, size, type) -> bool:
+        r = self.client.put(
+            url,
+            content=get_range(
+                path, offset, length, self.settings.x_file_stream_chunk_size
+            ),
+            headers={
+                "Content-Type": type,
+                "Content-Length": str(length),
+                "Content-Range": f"bytes {offset}-{offset + length - 1}/{size}",
+            },
+        )
+        if r.status_code not in [200, 201, 204, 308]:
+            raise httpx.HTTPStatusError(
+                f"response code {r.status_code}: {r.text}",
+                request=r.request,
+                response=r,
+            )
+        return True
+
+
+class DaemonExecutor(concurrent.futures.Executor):
+    """Bounded pool of daemon threads, so requests still running never hold up exit"""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = tag) -> None:
+        self._max_workers = max_workers
+        self._prefix = thread_name_prefix
+        self._queue = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._shutdown = False
+
+    def submit(self, fn, /, *args, **kwargs) -> concurrent.futures.Future:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            f = concurrent.futures.Future()
+            self._queue.put((f, fn, args, kwargs))
+            if (
+                not self._idle.acquire(blocking=False)
+                and len(self._threads) < self._max_workers
+            ):
+                t = threading.Thread(
+                    target=self._work,
+                    name=f"{self._prefix}_{len(self._threads)}",
+                    daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+        return f
+
+    def shutdown(self, wait=True, *, cancel_futures=False) -> None:
+        with self._lock:
+            self._shutdown = True
+            while cancel_futures:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+            self._queue.put(None)  # passed on by each worker
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.put(None)
+                return
+            f, fn, args, kwargs = item
+            if f.set_running_or_notify_cancel():
+                try:
+                    f.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    f.set_exception(e)
+            del item, f  # drop references before idling
+            self._idle.release()
+
+
+class Multipart:
+    """Part manifest of one upload, persisted so an interrupted upload can resume"""
+
+    def __init__(self, path: str, **kwargs) -> None:
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.__dict__.update(json.load(f))
+        else:
+            self.url = kwargs["url"]
+            self.file = kwargs["file"]
+            self.size = kwargs["size"]
+            self.type = kwargs["type"]
+            self.part_size = kwargs["part_size"]
+            self.done = []
+            self.save()
+
+    def parts(self) -> List[Tuple[int, int, int]]:
+        return [
+            (i, o, min(self.part_size, self.size - o))
+            for i, o in enumerate(range(0, self.size, self.part_size))
+        ]
+
+    def pending(self) -> List[Tuple[int, int, int]]:
+        done = set(self.done)
+        return [p for p in self.parts() if p[0] not in done]
+
+    def mark(self, i: int) -> None:
+        with self._lock:
+            self.done.append(i)
+            self.save()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        d = {
+            k: getattr(self, k)
+            for k in ["url", "file", "size", "type", "part_size", "done"]
+        }
+        d["pid"] = os.getpid()
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(d, f)
+        os.replace(self.path + ".tmp", self.path)  # never leave a torn manifest
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def upload(transfer: Transfer, m: Multipart, settings: Settings) -> bool:
+    def part(i, offset, length):
+        for retry in range(settings.x_file_stream_retry_max):
+            try:
+                if transfer.put_part(m.url, m.file, offset, length, m.size, m.type):
+                    m.mark(i)
+                    return True
+            except Exception as e:
+                logger.debug(
+                    "%s: part %s of %s: retry %s/%s: %s: %s",
+                    tag,
+                    i,
+                    m.file,
+                    retry + 1,
+                    settings.x_file_stream_retry_max,
+                    type(e).__name__,
+                    e,
+                )
+            time.sleep(
+                min(
+                    settings.x_file_stream_retry_wait_min_seconds * (2 ** (retry + 1)),
+                    settings.x_file_stream_retry_wait_max_seconds,
+                )
+            )
+        return False
+
+    with _lock_active:
+        if m.path in ACTIVE:
+            return False
+        ACTIVE.add(m.path)
+    try:
+        with DaemonExecutor(settings.x_file_stream_part_conn) as e:
+            list(e.map(lambda p: part(*p), m.pending()))
+    finally:
+        with _lock_active:
+            ACTIVE.discard(m.path)
+
+    failed = len(m.pending())
+    if failed:
+        logger.error(
+            f"{tag}: {failed}/{len(m.parts())} part(s) of {m.file} failed: resume with `mlop resume {os.path.dirname(os.path.dirname(m.path))}`"
+        )
+        return False
+    if not transfer.complete(m.url, m.size, m.type):
+        logger.error(f"{tag}: failed to complete upload of {m.file}")
+        return False
+    m.remove()
+    return True
+
+
+def find(dir: str) -> List[str]:
+    # manifests under dir that no other live process is working on
+    r = []
+    pattern = os.path.join(os.path.abspath(dir), "**", "uploads", "*.json")
+    for path in glob.glob(pattern, recursive=True):
+        try:
+            with open(path) as f:
+                pid = json.load(f).get("pid")
+        except Exception as e:
+            logger.debug("%s: failed to read manifest %s: %s", tag, path, e)
+            continue
+        with _lock_active:
+            if path in ACTIVE:
+                continue
+        if pid == os.getpid() or pid is None or not psutil.pid_exists(pid):
+            r.append(path)
+    return r
+
+
+def resume(path: str, transfer: Transfer, settings: Settings) -> Union[bool, None]:
+    m = Multipart(path)
+    if not os.path.exists(m.file):
+        logger.warning(f"{tag}: {m.file} no longer exists: dropping {path}")
+        m.remove()
+        return None
+    logger.info(
+        f"{tag}: resuming {m.file} with {len(m.pending())}/{len(m.parts())} part(s) pending"
+    )
+    return upload(transfer, m, settings) or None
+
+
+def get_range(path, offset, length, size):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            b = f.read(min(size, length))
+            if not b:
+                break
+            length -= len(b)
+            yield b
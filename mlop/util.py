@@ -12,7 +12,7 @@ import subprocess
 import sys
 import time
 import uuid
-from typing import Any, Dict, Sequence, Union
+from typing import Any, Dict, List, Sequence, Union
 
 import numpy as np
 
@@ -53,6 +53,44 @@ class ANSI:
             os.system("")
 
 
+class Registry:
+    """Per-run index of logged keys; sanitises and classifies each key once"""
+
+    def __init__(self) -> None:
+        self._keys = {}  # raw key -> entry
+        self._names = {}  # sanitised name -> entry
+
+    def get(self, k: str) -> Union[Dict[str, Any], None]:
+        return self._keys.get(k)
+
+    def add(self, k: str, kind: str, step: int):
+        name = get_char(k)
+        e = self._names.get(name)
+        if e is None:
+            e = self._names[name] = {
+                "id": len(self._names),
+                "name": name,
+                "kind": kind,  # num | file | data
+                "step": step,
+            }
+            self._keys[k] = e
+            return e, True
+        self._keys[k] = e
+        return e, False
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def values(self):
+        return self._names.values()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
 def print_url(url):
     return f"{ANSI.underline}{url}{ANSI.reset}"
 
@@ -227,48 +265,133 @@ def get_class(val: any) -> str:
 
 
 def get_val(v: Any):
-    class_name = get_class(v)
-
+    f = VAL.get(type(v))
+    if f is None:
+        f = VAL[type(v)] = get_conv(type(v))  # resolve once per type
     try:
-        if class_name.startswith("tensorflow."):
-            if "EagerTensor" in class_name:
-                v = v.numpy()
-            elif "Tensor" in class_name or "Variable" in class_name:
-                try:
-                    v = v.eval()
-                except RuntimeError:
-                    v = v.numpy()
-        elif class_name.startswith(("torch.", "fastai.")) and (
-            "Tensor" in class_name or "Variable" in class_name
-        ):
-            try:
-                if v.requires_grad:
-                    v = v.detach()
-                v = v.data
-            except Exception:
-                pass
-            if v.size():
-                v = v.cpu().detach().numpy()
-            else:
-                v = v.item()
-        elif class_name.startswith("jaxlib.") and "Array" in class_name:
-            jax = import_lib("jax")
-            v = jax.device_get(v)
-
-        if isinstance(v, np.ndarray):
-            if v.size == 1:
-                v = v.flatten()[0]
-        elif isinstance(v, np.generic):
-            v = v.item()
-            if isinstance(v, np.generic) and (
-                v.dtype.kind == "f" or v.dtype == "bfloat16"
-            ):
-                v = float(v)
-        elif isinstance(v, bytes):
-            v = v.decode("utf-8")
-
-        if isinstance(v, (float, int)) and not math.isnan(v):
-            return v
+        return f(v)
     except Exception as e:
         logger.debug("%s: %s", tag, e)
     return 0
+
+
+def get_conv(t: type):
+    class_name = t.__module__ + "." + t.__name__
+    if class_name.startswith("tensorflow."):
+        if "EagerTensor" in class_name:
+            return conv_tf_eager
+        elif "Tensor" in class_name or "Variable" in class_name:
+            return conv_tf
+    elif class_name.startswith(("torch.", "fastai.")) and (
+        "Tensor" in class_name or "Variable" in class_name
+    ):
+        return conv_torch
+    elif class_name.startswith("jaxlib.") and "Array" in class_name:
+        return conv_jax
+    return conv_np
+
+
+def conv_float(v):
+    return v if v == v else 0  # nan
+
+
+def conv_num(v):
+    if isinstance(v, (float, int)) and not math.isnan(v):
+        return v
+    return 0
+
+
+def conv_np(v):
+    if isinstance(v, np.ndarray):
+        if v.size != 1:
+            return 0
+        v = v.reshape(-1)[0]
+    if isinstance(v, np.generic):
+        v = v.item()
+        if isinstance(v, np.generic) and (v.dtype.kind == "f" or v.dtype == "bfloat16"):
+            v = float(v)
+    elif isinstance(v, bytes):
+        v = v.decode("utf-8")
+    return conv_num(v)
+
+
+def conv_tf_eager(v):
+    return conv_np(v.numpy())
+
+
+def conv_tf(v):
+    try:
+        v = v.eval()
+    except RuntimeError:
+        v = v.numpy()
+    return conv_np(v)
+
+
+def conv_torch(v):
+    try:
+        if v.requires_grad:
+            v = v.detach()
+        v = v.data
+    except Exception:
+        pass
+    if v.size():
+        v = v.cpu().detach().numpy()
+    else:
+        v = v.item()
+    return conv_np(v)
+
+
+def conv_jax(v):
+    return conv_np(import_lib("jax").device_get(v))
+
+
+VAL = {float: conv_float, int: conv_num, bool: conv_num}
+
+
+def get_tensors(data: Sequence[Any]) -> List[Any]:
+    # gather scalar tensors across dicts and move them to host in one transfer per device
+    g = {}
+    for i, d in enumerate(data):
+        if not isinstance(d, dict):
+            continue
+        for k, v in d.items():
+            f = VAL.get(type(v))
+            if f is None:
+                f = VAL[type(v)] = get_conv(type(v))
+            if f is conv_torch and v.numel() == 1:
+                g.setdefault((v.device, v.dtype), []).append((i, k, v))
+    if not g:
+        return list(data)
+
+    torch = import_lib("torch")
+    data = list(data)
+    c = set()
+    for e in g.values():
+        vals = torch.stack([v.detach().reshape(()) for _, _, v in e]).cpu().tolist()
+        for (i, k, _), v in zip(e, vals):
+            if i not in c:  # do not mutate caller dicts
+                data[i] = data[i].copy()
+                c.add(i)
+            data[i][k] = v
+    return data
+
+
+def get_array(v: Any) -> np.ndarray:
+    if isinstance(v, (list, tuple)) and len(v) and get_class(v[0]).startswith("torch."):
+        v = import_lib("torch").stack(list(v))  # single transfer for all scalars
+    class_name = get_class(v)
+
+    if class_name.startswith("torch.") and "Tensor" in class_name:
+        v = v.detach().cpu()
+        try:
+            v = v.numpy()
+        except TypeError:  # bfloat16 and other dtypes numpy lacks
+            v = v.float().numpy()
+    elif class_name.startswith("tensorflow.") or (
+        class_name.startswith("jaxlib.") and "Array" in class_name
+    ):
+        v = np.asarray(v)
+
+    a = np.array(v, dtype=np.float64)  # copy to decouple from caller buffers
+    a[np.isnan(a)] = 0
+    return a
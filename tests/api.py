@@ -0,0 +1,114 @@
+import json
+import random
+import time
+
+import numpy as np
+
+from .args import init_test, timer
+
+TAG = "api"
+
+
+def bench(api, name, make, NUM_EPOCHS):
+    r = {}
+    backends = {
+        api.JSON: api.dumps,
+        "json": lambda obj: json.dumps(obj, separators=(",", ":")).encode(),
+    }
+    dumps = api.dumps
+    try:
+        for backend, f in backends.items():
+            api.dumps = f
+            n, s = 0, time.time()
+            for i in range(NUM_EPOCHS):
+                n += len(make(i))
+            r[backend] = n / (time.time() - s)
+    finally:
+        api.dumps = dumps
+    print(
+        f"{TAG}: {name}: "
+        + ", ".join(f"{k} {v / 2**20:.1f} MiB/s" for k, v in r.items())
+        + f" ({r[api.JSON] / r['json']:.1f}x)"
+    )
+
+
+@timer
+def test_api_num(mlop, run, NUM_EPOCHS=10_000, ITEM_PER_EPOCH=100):
+    from mlop import api
+
+    data = {f"num/{TAG}-{j}": random.random() for j in range(ITEM_PER_EPOCH)}
+    bench(
+        api, "num", lambda i: api.make_compat_num_v1(data, time.time(), i), NUM_EPOCHS
+    )
+
+    keys = list(data)
+    values = np.random.rand(100, ITEM_PER_EPOCH)
+    steps, timestamps = np.arange(100), np.full(100, time.time())
+    bench(
+        api,
+        "num batch",
+        lambda i: api.make_compat_num_batch_v1(keys, steps, values, timestamps),
+        NUM_EPOCHS // 100,
+    )
+
+
+@timer
+def test_api_data(mlop, run, NUM_EPOCHS=1_000, ITEM_PER_EPOCH=10):
+    from mlop import api
+
+    data = {
+        f"hist/{TAG}-{j}": [mlop.Histogram([random.random() for _ in range(1_000)])]
+        for j in range(ITEM_PER_EPOCH)
+    }
+    bench(
+        api,
+        "histogram",
+        lambda i: api.make_compat_data_v1(data, time.time(), i),
+        NUM_EPOCHS,
+    )
+
+    data = {
+        f"table/{TAG}-{j}": [
+            mlop.Table(
+                columns=[f"c{c}" for c in range(10)],
+                data=[[random.random() for _ in range(10)] for _ in range(100)],
+            )
+        ]
+        for j in range(ITEM_PER_EPOCH)
+    }
+    bench(
+        api,
+        "table",
+        lambda i: api.make_compat_data_v1(data, time.time(), i),
+        NUM_EPOCHS,
+    )
+
+
+@timer
+def test_api_meta(mlop, run, NUM_EPOCHS=10_000, ITEM_PER_EPOCH=100):
+    from mlop import api
+
+    names = [f"meta/{TAG}-{j}" for j in range(ITEM_PER_EPOCH)]
+    bench(
+        api,
+        "meta",
+        lambda i: api.make_compat_meta_v1(names, "num", run.settings),
+        NUM_EPOCHS,
+    )
+    bench(
+        api,
+        "start",
+        lambda i: api.make_compat_start_v1(
+            {"lr": 1e-3, "layers": list(range(ITEM_PER_EPOCH))},
+            run.settings,
+            run.settings._sys.get_info(),
+        ),
+        NUM_EPOCHS // 100,
+    )
+
+
+if __name__ == "__main__":
+    mlop, run = init_test(TAG)
+    test_api_num(mlop, run)
+    test_api_data(mlop, run)
+    test_api_meta(mlop, run)
@@ -44,6 +44,43 @@ def test_audio(
         time.sleep(WAIT)
 
 
+@timer
+def test_audio_format(mlop, run, NUM_EPOCHS=5, SECONDS=60, RATE=48000):
+    from mlop.media import load
+
+    t = np.arange(SECONDS * RATE) / RATE
+    tone = np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.5 * t))
+    data = np.stack([tone, np.roll(tone, 100)], axis=1) * 0.5
+    data = (data + np.random.normal(0, 0.01, data.shape)).astype(np.float32)
+    os.makedirs(f"{run.settings.get_dir()}/files", exist_ok=True)
+    for format in ["wav", "flac", "ogg", "opus"]:
+        s, size = time.time(), 0
+        for _ in range(NUM_EPOCHS):
+            f = load(
+                mlop.Audio(data, rate=RATE, format=format), run.settings.get_dir()
+            )
+            size += f._stat.st_size
+        e = time.time() - s
+        print(
+            f"{TAG}: {format}: {size / NUM_EPOCHS / 2**20:.2f} MiB per {SECONDS}s clip ({data.nbytes / (size / NUM_EPOCHS):.1f}x), {NUM_EPOCHS * SECONDS / e:.0f}x realtime"
+        )
+
+    try:
+        import torch
+
+        s = time.time()
+        tensor = torch.from_numpy(data.T.copy())  # (channel, time)
+        f = load(
+            mlop.Audio(tensor, rate=RATE, format="flac"), run.settings.get_dir()
+        )
+        print(
+            f"{TAG}: tensor: {f._stat.st_size / 2**20:.2f} MiB in {time.time() - s:.2f}s"
+        )
+    except ImportError:
+        pass
+
+
 if __name__ == "__main__":
     mlop, run = init_test(TAG)
     test_audio(mlop, run)
+    test_audio_format(mlop, run)
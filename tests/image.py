@@ -81,6 +81,129 @@ def test_image(
         time.sleep(WAIT)
 
 
+@timer
+def test_image_format(mlop, run, NUM_EPOCHS=10, SIZE=(1024, 1024)):
+    from mlop.media import load
+
+    x, y = np.meshgrid(np.linspace(0, 1, SIZE[1]), np.linspace(0, 1, SIZE[0]))
+    images = [
+        (
+            np.stack([x, y, (x + y) / 2], axis=-1) * 200
+            + np.random.randint(0, 56, size=(*SIZE, 3))
+        ).astype(np.uint8)
+        for _ in range(NUM_EPOCHS)
+    ]
+    os.makedirs(f"{run.settings.get_dir()}/files", exist_ok=True)
+    for kwargs in [
+        {},
+        {"compress_level": 1},
+        {"format": "webp"},
+        {"format": "jpeg", "quality": 85},
+        {"format": "webp", "max_size": 512},
+    ]:
+        s, size = time.time(), 0
+        for i in images:
+            f = load(mlop.Image(i, **kwargs), run.settings.get_dir())
+            size += f._stat.st_size
+        print(
+            f"{TAG}: {kwargs or 'png'}: {size / NUM_EPOCHS / 2**10:.0f} KiB per image, {(time.time() - s) / NUM_EPOCHS * 1000:.0f} ms per image"
+        )
+
+    path = f".mlop/{TAG}-source.jpg"
+    Image.fromarray(images[0]).save(path, quality=90)
+    f = load(mlop.Image(Image.open(path)), run.settings.get_dir())
+    with open(path, "rb") as a, open(f._path, "rb") as b:
+        print(f"{TAG}: compressed source reused: {a.read() == b.read()}")
+    os.remove(path)
+
+
+@timer
+def test_image_batch(mlop, run, NUM_EPOCHS=20, ITEM_PER_EPOCH=64, SIZE=(256, 256, 3)):
+    from .server import serve
+
+    serve()
+    images = [
+        np.random.randint(low=0, high=256, size=SIZE, dtype=np.uint8)
+        for _ in range(ITEM_PER_EPOCH)
+    ]
+    for executor in [None, "thread", "process"]:
+        settings = mlop.Settings()
+        settings.update(
+            {
+                "host": "localhost",
+                "_auth": TAG,
+                "disable_iface": True,  # measure encoding alone
+                "x_media_executor": executor,
+            }
+        )
+        r = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+        s = time.time()
+        for e in range(NUM_EPOCHS):
+            r.log({f"{TAG}/batch": [mlop.Image(i) for i in images]})
+        r.finish()
+        e = time.time() - s
+        print(
+            f"{TAG}: {executor or 'inline'}: {NUM_EPOCHS * ITEM_PER_EPOCH} image(s) in {e:.2f}s ({NUM_EPOCHS * ITEM_PER_EPOCH / e:.0f} images/s)"
+        )
+
+
+@timer
+def test_image_budget(mlop, run, NUM_ITEMS=64, SIZE=(1024, 1024, 3), BUDGET=2**26):
+    import psutil
+
+    from .server import serve
+
+    serve()
+    for policy in [None, "block", "stage", "drop"]:
+        settings = mlop.Settings()
+        settings.update(
+            {
+                "host": "localhost",
+                "_auth": TAG,
+                "disable_iface": True,
+                "x_media_budget_bytes": BUDGET if policy else 0,
+                "x_media_budget_policy": policy or "stage",
+            }
+        )
+        r = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+        p = psutil.Process()
+        base, peak = p.memory_info().rss, 0
+        s = time.time()
+        for i in range(NUM_ITEMS):  # a burst faster than the worker encodes
+            r.log({f"{TAG}/budget": mlop.Image(np.full(SIZE, i, dtype=np.uint8))})
+            peak = max(peak, p.memory_info().rss - base)
+        e = time.time() - s
+        r.finish()
+        print(
+            f"{TAG}: {policy or 'unbounded'}: {NUM_ITEMS} image(s) logged in {e:.2f}s, peak +{peak / 2**20:.0f} MiB: {mlop.budget.BUDGET.stats()}"
+        )
+        mlop.budget.BUDGET.peak = mlop.budget.BUDGET.staged = 0
+        mlop.budget.BUDGET.drops = 0
+
+    settings = mlop.Settings()
+    settings.update(
+        {
+            "host": "localhost",
+            "_auth": TAG,
+            "disable_iface": True,
+            "x_media_budget_bytes": BUDGET,
+            "x_media_budget_policy": "block",
+        }
+    )
+    r = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+    s = time.time()  # nothing is queued for encoding, so blocking cannot free budget
+    batch = [mlop.Image(np.full(SIZE, i, dtype=np.uint8)) for i in range(NUM_ITEMS)]
+    e = time.time() - s
+    r.log({f"{TAG}/budget": batch})
+    r.finish()
+    print(
+        f"{TAG}: block: {NUM_ITEMS} image(s) built before logging in {e:.2f}s: {mlop.budget.BUDGET.stats()}"
+    )
+
+
 if __name__ == "__main__":
     mlop, run = init_test(TAG)
     test_image(mlop, run)
+    test_image_format(mlop, run)
+    test_image_batch(mlop, run)
+    test_image_budget(mlop, run)
@@ -0,0 +1,403 @@
+import hashlib
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+
+from mlop.transfer import Transfer
+
+from .args import timer
+from .server import serve, spawn
+
+TAG = "ingest"
+
+
+@timer
+def test_ingest_compress(mlop, NUM_EPOCHS=2_000, ITEM_PER_EPOCH=20):
+    stats = serve()
+    for compression in [None, "gzip", "zstd"]:
+        for k in stats:
+            stats[k].clear()
+        settings = mlop.Settings()
+        settings.update(
+            {
+                "host": "localhost",
+                "_auth": TAG,
+                "x_file_stream_compression": compression,
+                "x_file_stream_transmit_interval": 1,
+            }
+        )
+        run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+        for i in range(NUM_EPOCHS):
+            run.log(
+                {f"{TAG}/metric-{j}": random.random() for j in range(ITEM_PER_EPOCH)}
+            )
+            if i % 100 == 0:
+                run.log({f"{TAG}/hist": mlop.Histogram(list(range(i + 1)))})
+                print(f"{TAG}: Epoch {i + 1} / {NUM_EPOCHS}")
+        s = time.time()
+        run.finish()
+        e = time.time() - s
+
+        ingest = [p for p in stats["raw"] if p.startswith("/ingest")]
+        raw = sum(stats["raw"][p] for p in ingest)
+        size = sum(stats["bytes"][p] for p in ingest)
+        lines = sum(stats["lines"][p] for p in ingest)
+        print(
+            f"{TAG}: compression={compression}: {lines} lines, {size} bytes sent as {raw} ({size / raw:.2f}x), finished in {e:.2f} seconds"
+        )
+
+
+@timer
+def test_ingest_connections(mlop, NUM_EPOCHS=200, ITEM_PER_EPOCH=4):
+    stats = serve()
+    stats["connections"].clear()
+    runs = []
+    for i in range(ITEM_PER_EPOCH):
+        settings = mlop.Settings()
+        settings.update({"host": "localhost", "_auth": TAG})
+        runs.append(mlop.init(dir=".mlop", project="test-" + TAG, settings=settings))
+    for i in range(NUM_EPOCHS):
+        for run in runs:
+            run.log({f"{TAG}/metric": random.random()})
+    for run in runs:
+        run.finish()
+    print(
+        f"{TAG}: {ITEM_PER_EPOCH} runs opened {sum(stats['connections'].values())} connections: {stats['connections']}"
+    )
+
+
+@timer
+def test_ingest_engine(mlop, NUM_EPOCHS=200, ITEM_PER_EPOCH=10):
+    server = spawn()
+    path = f".mlop/{TAG}.txt"
+    with open(path, "w") as f:
+        f.write(TAG * 1_000)
+    for engine in ["thread", "async"]:
+        settings = mlop.Settings()
+        settings.update(
+            {"host": "localhost", "_auth": TAG, "x_internal_engine": engine}
+        )
+        run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+        threads, s, c = 0, time.time(), time.process_time()
+        for i in range(NUM_EPOCHS):
+            run.log(
+                {
+                    **{
+                        f"{TAG}/metric-{j}": random.random()
+                        for j in range(ITEM_PER_EPOCH)
+                    },
+                    f"{TAG}/new-{i}": i,  # metadata update per step
+                    f"{TAG}/text": mlop.Text(path),  # file upload per step
+                }
+            )
+            threads = max(threads, threading.active_count())
+        run.finish()
+        print(
+            f"{TAG}: engine={engine}: peak {threads} threads, {time.process_time() - c:.2f}s cpu over {time.time() - s:.2f}s"
+        )
+    server.terminate()
+
+
+@timer
+def test_ingest_upload(mlop, NUM_EPOCHS=1_000, ITEM_PER_EPOCH=1):
+    server = spawn()
+    path = f".mlop/{TAG}.txt"
+    with open(path, "w") as f:
+        f.write(TAG * 1_000)
+    settings = mlop.Settings()
+    settings.update({"host": "localhost", "_auth": TAG})
+    run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+    threads = 0
+    for i in range(NUM_EPOCHS):
+        run.log({f"{TAG}/file-{j}": mlop.Text(path) for j in range(ITEM_PER_EPOCH)})
+        threads = max(threads, threading.active_count())
+    s = time.time()
+    run.finish()
+    print(
+        f"{TAG}: {NUM_EPOCHS * ITEM_PER_EPOCH} uploads: peak {threads} threads, {len(run._iface._failed)} failed, drained in {time.time() - s:.2f}s"
+    )
+    server.terminate()
+
+
+@timer
+def test_ingest_large(mlop, SIZE=2**32):
+    import psutil
+
+    server = spawn()
+    path = f".mlop/{TAG}.bin"
+    with open(path, "wb") as f:
+        f.truncate(SIZE)  # sparse
+    settings = mlop.Settings()
+    settings.update({"host": "localhost", "_auth": TAG})
+    run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+
+    p, rss, done = psutil.Process(), [], threading.Event()
+
+    def sample():
+        while not done.is_set():
+            rss.append(p.memory_info().rss)
+            time.sleep(0.05)
+
+    base = p.memory_info().rss
+    t = threading.Thread(target=sample, daemon=True)
+    t.start()
+    s = time.time()
+    artifact = mlop.Artifact(path)
+    run.log({f"{TAG}/artifact": artifact})
+    run.finish()
+    done.set()
+    t.join()
+    os.remove(path)
+    os.remove(artifact._path)  # copy in the run directory
+    print(
+        f"{TAG}: uploaded {SIZE / 2**30:.1f} GiB in {time.time() - s:.2f}s: peak rss {max(rss) / 2**20:.0f} MiB ({(max(rss) - base) / 2**20:+.0f} MiB), {len(run._iface._failed)} failed"
+    )
+    server.terminate()
+
+
+class Store(Transfer):
+    # local stand-in object store that assembles parts in a directory
+    def __init__(self, dir, fail=None):
+        self.dir, self.fail, self.parts, self.files = dir, fail, 0, set()
+        os.makedirs(dir, exist_ok=True)
+
+    def put_part(self, url, path, offset, length, size, type):
+        if self.fail is not None and self.parts >= self.fail:
+            raise ConnectionError("interrupted")
+        dst = os.path.join(self.dir, os.path.basename(url))
+        mode = "r+b" if os.path.exists(dst) else "w+b"
+        with open(path, "rb") as src, open(dst, mode) as f:
+            src.seek(offset)
+            f.seek(offset)
+            f.write(src.read(length))
+        self.parts += 1
+        self.files.add(dst)
+        return True
+
+
+@timer
+def test_ingest_multipart(mlop, SIZE=2**25, PART_SIZE=2**21):
+    from mlop.transfer import find, resume
+
+    server = spawn()
+    path = f".mlop/{TAG}-multipart.bin"
+    os.makedirs(".mlop", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(os.urandom(SIZE))
+    settings = mlop.Settings()
+    settings.update(
+        {
+            "host": "localhost",
+            "_auth": TAG,
+            "x_file_stream_multipart": True,  # the stand-in store assembles ranges
+            "x_file_stream_part_size": PART_SIZE,
+            "x_file_stream_retry_max": 2,
+            "x_file_stream_retry_wait_max_seconds": 0.1,
+        }
+    )
+    run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+    store = Store(".mlop/store", fail=SIZE // PART_SIZE // 2)  # interrupt halfway
+    run._iface._transfer = store
+    artifact = mlop.Artifact(path)
+    run.log({f"{TAG}/multipart": artifact})
+    run.finish()
+    manifests = find(os.path.dirname(run.settings.get_dir()))
+    print(
+        f"{TAG}: interrupted after {store.parts} part(s), {len(manifests)} manifest(s)"
+    )
+
+    store = Store(".mlop/store")
+    s = time.time()
+    ok = [resume(m, store, run.settings) for m in manifests]
+    with open(path, "rb") as a, open(store.files.pop(), "rb") as b:
+        match = hashlib.sha256(a.read()).digest() == hashlib.sha256(b.read()).digest()
+    print(
+        f"{TAG}: resumed {sum(map(bool, ok))}/{len(ok)} upload(s) with {store.parts} part(s) in {time.time() - s:.2f}s: {'intact' if match else 'corrupt'}, {len(find(os.path.dirname(run.settings.get_dir())))} manifest(s) left"
+    )
+    os.remove(path)
+    os.remove(artifact._path)
+    shutil.rmtree(store.dir)
+    server.terminate()
+
+
+@timer
+def test_ingest_dedup(mlop, SIZE=2**28, NUM_EPOCHS=10):
+    stats = serve()
+    stats["requests"].clear()
+    stats["urls"].clear()
+    path = f".mlop/{TAG}-dedup.bin"
+    os.makedirs(".mlop", exist_ok=True)
+    with open(path, "wb") as f:
+        for _ in range(SIZE // 2**24):
+            f.write(os.urandom(2**24))
+    os.utime(path, ns=(time.time_ns() - 10**10,) * 2)  # settled on disk
+    settings = mlop.Settings()
+    settings.update({"host": "localhost", "_auth": TAG})
+    run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+    for i in range(NUM_EPOCHS):
+        s = time.time()
+        f = mlop.File(path, name="checkpoint")
+        print(
+            f"{TAG}: epoch {i + 1}: hashed {SIZE / 2**20:.0f} MiB in {time.time() - s:.3f}s"
+        )
+        run.log({f"{TAG}/checkpoint": f, f"{TAG}/model": mlop.Artifact(path, "model")})
+    run.finish()
+    puts = sum(v for k, v in stats["requests"].items() if k.startswith("/storage"))
+    empty = [k for k, v in stats["urls"].items() if not v]
+    print(
+        f"{TAG}: logged {NUM_EPOCHS} unchanged checkpoint(s) and artifact(s) with {len(stats['urls'])} registration(s), {puts} upload(s), {len(empty)} without upload"
+    )
+    assert not empty, empty
+    os.remove(path)
+    os.remove(f._path)
+
+
+@timer
+def test_ingest_blob(mlop, SIZE=2**28, NUM_RUNS=8):
+    from mlop.blob import gc
+
+    serve()
+    path = f".mlop/{TAG}-blob.bin"
+    os.makedirs(".mlop", exist_ok=True)
+    with open(path, "wb") as f:
+        for _ in range(SIZE // 2**24):
+            f.write(os.urandom(2**24))
+
+    mkcopy, elapsed = mlop.File._mkcopy, []
+
+    def timed(self, *args, **kwargs):  # time spent placing files in the run
+        s = time.time()
+        mkcopy(self, *args, **kwargs)
+        elapsed.append(time.time() - s)
+
+    mlop.File._mkcopy = timed
+    for blob in [False, True]:
+        elapsed.clear()
+        dirs, inodes = [], {}
+        for i in range(NUM_RUNS):
+            settings = mlop.Settings()
+            settings.update({"host": "localhost", "_auth": TAG, "x_file_blob": blob})
+            run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+            run.log({f"{TAG}/artifact": mlop.Artifact(path, caption="sweep")})
+            run.finish()
+            dirs.append(run.settings.get_dir())
+            for name in os.listdir(f"{dirs[-1]}/files"):
+                st = os.stat(f"{dirs[-1]}/files/{name}")
+                inodes[st.st_ino] = st.st_size
+        for d in dirs:
+            shutil.rmtree(d)
+        print(
+            f"{TAG}: {'blob' if blob else 'copy'}: {NUM_RUNS} run(s) placed files in {sum(elapsed):.3f}s, {sum(inodes.values()) / 2**20:.0f} MiB on disk"
+        )
+    mlop.File._mkcopy = mkcopy
+    n, size = gc()
+    print(f"{TAG}: gc removed {n} blob(s), {size / 2**20:.0f} MiB")
+    os.remove(path)
+
+
+@timer
+def test_ingest_files(mlop, NUM_EPOCHS=10_000):
+    stats = serve()
+    stats["requests"].clear()
+    os.makedirs(f".mlop/{TAG}-files", exist_ok=True)
+    paths = []
+    for i in range(NUM_EPOCHS):
+        paths.append(f".mlop/{TAG}-files/{i}.txt")
+        with open(paths[-1], "w") as f:
+            f.write(f"{TAG} {i}")
+    settings = mlop.Settings()
+    settings.update({"host": "localhost", "_auth": TAG, "x_file_blob": False})
+    run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+    s = time.time()
+    for i, path in enumerate(paths):
+        run.log({f"{TAG}/sample": mlop.File(path, name=f"sample-{i}")})
+    run.finish()
+    e = time.time() - s
+    r = stats["requests"]
+    print(
+        f"{TAG}: logged {NUM_EPOCHS} file(s) in {e:.2f}s ({NUM_EPOCHS / e:.0f} files/s): {r.get('/files', 0)} file request(s), {sum(v for k, v in r.items() if k.startswith('/storage'))} upload(s), {len(run._iface._failed)} failed"
+    )
+    shutil.rmtree(f".mlop/{TAG}-files")
+
+
+@timer
+def test_ingest_steps(mlop, NUM_EPOCHS=2):
+    stats = serve()
+    stats["requests"].clear()
+    path = f".mlop/{TAG}-checkpoint.txt"
+    os.makedirs(".mlop", exist_ok=True)
+    settings = mlop.Settings()
+    settings.update({"host": "localhost", "_auth": TAG})
+    run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+    for i in range(NUM_EPOCHS):  # same name at every step, registered in one batch
+        with open(path, "w") as f:
+            f.write(f"{TAG} {i}")
+        run.log({f"{TAG}/checkpoint": mlop.File(path, name="checkpoint")})
+    run.finish()
+    r = stats["requests"]
+    uploads = sorted(p for p in r if p.endswith("/checkpoint.txt"))  # one per step
+    print(
+        f"{TAG}: {r.get('/files', 0)} file request(s), {len(uploads)} upload(s) for {NUM_EPOCHS} step(s): {uploads}"
+    )
+    assert len(uploads) == NUM_EPOCHS
+    os.remove(path)
+
+
+@timer
+def test_ingest_offline(mlop, NUM_EPOCHS=20_000, ITEM_PER_EPOCH=20, NUM_FILES=64):
+    from mlop.sync import sync
+
+    stats = serve()
+    for offline in [False, True]:
+        for k in stats:
+            stats[k].clear()
+        settings = mlop.Settings()
+        settings.update({"host": "localhost", "_auth": TAG, "offline": offline})
+        run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+        s = time.time()
+        for i in range(NUM_EPOCHS):
+            run.log(
+                {f"{TAG}/metric-{j}": random.random() for j in range(ITEM_PER_EPOCH)}
+            )
+            if i % (NUM_EPOCHS // NUM_FILES) == 0:
+                run.log({f"{TAG}/text": mlop.Text(f"{TAG} {i}")})
+                print(f"{TAG}: Epoch {i + 1} / {NUM_EPOCHS}")
+        run.finish()
+        e = time.time() - s
+        print(
+            f"{TAG}: {'offline' if offline else 'online'}: logged in {e:.2f}s ({NUM_EPOCHS / e:.0f} steps/s), {sum(stats['requests'].values())} request(s)"
+        )
+
+    conn = sqlite3.connect(f"{settings.get_dir()}/{settings.store_db}")
+    kinds = dict(conn.execute("SELECT kind, COUNT(*) FROM record GROUP BY kind"))
+    conn.close()
+    print(f"{TAG}: recorded {kinds}")
+    assert "webhook" not in kinds  # trigger polls are not recorded
+
+    s = time.time()
+    assert sync(settings.get_dir(), settings={"_auth": TAG})
+    e = time.time() - s
+    r, lines = stats["requests"], stats["lines"]
+    print(
+        f"{TAG}: synced in {e:.2f}s: {lines.get('/ingest/metrics', 0)} metric line(s) in {r.get('/ingest/metrics', 0)} request(s), {lines.get('/ingest/logs', 0)} console line(s), {r.get('/files', 0)} file request(s), {sum(v for k, v in r.items() if k.startswith('/storage'))} upload(s)"
+    )
+    assert sync(settings.get_dir(), settings={"_auth": TAG})  # already synced
+
+
+if __name__ == "__main__":
+    import mlop
+
+    test_ingest_compress(mlop)
+    test_ingest_connections(mlop)
+    test_ingest_engine(mlop)
+    test_ingest_upload(mlop)
+    test_ingest_multipart(mlop)
+    test_ingest_dedup(mlop)
+    test_ingest_blob(mlop)
+    test_ingest_files(mlop)
+    test_ingest_steps(mlop)
+    test_ingest_large(mlop)
+    test_ingest_offline(mlop)
@@ -2,6 +2,8 @@ import math
 import random
 import time
 
+import numpy as np
+
 from .args import get_prefs, init_test, timer
 
 TAG = "metric"
@@ -39,6 +41,179 @@ def test_metric(mlop, run, NUM_EPOCHS=None, ITEM_PER_EPOCH=None):
             time.sleep(WAIT)
 
 
+def wait(run):
+    while not run._queue.empty():
+        time.sleep(0.001)
+
+
+@timer
+def test_metric_batch(mlop, run, NUM_EPOCHS=None, ITEM_PER_EPOCH=None):
+    if NUM_EPOCHS is None or ITEM_PER_EPOCH is None:
+        NUM_EPOCHS = get_prefs(TAG)["NUM_EPOCHS"] * 100
+        ITEM_PER_EPOCH = get_prefs(TAG)["ITEM_PER_EPOCH"]
+
+    values = np.random.rand(NUM_EPOCHS, ITEM_PER_EPOCH)
+    steps = np.arange(NUM_EPOCHS) + 1
+
+    keys = [f"loop/{TAG}-{j}" for j in range(ITEM_PER_EPOCH)]
+    s = time.time()
+    for i in range(NUM_EPOCHS):
+        run.log({k: values[i, j] for j, k in enumerate(keys)}, step=int(steps[i]))
+    wait(run)
+    loop = values.size / (time.time() - s)
+
+    keys = [f"batch/{TAG}-{j}" for j in range(ITEM_PER_EPOCH)]
+    s = time.time()
+    run.log_batch(keys, steps=steps, values=values)
+    wait(run)
+    batch = values.size / (time.time() - s)
+
+    print(
+        f"{TAG}: {values.size} points: log {loop:.0f} points/s, log_batch {batch:.0f} points/s ({batch / loop:.1f}x)"
+    )
+
+
+@timer
+def test_metric_keys(mlop, run, NUM_EPOCHS=10, ITEM_PER_EPOCH=10_000):
+    keys = [f"layer/{TAG}-{j}" for j in range(ITEM_PER_EPOCH)]
+    for i in range(NUM_EPOCHS):
+        s = time.time()
+        run._log({k: random.random() for k in keys}, step=None)  # bypass queue
+        print(
+            f"{TAG}: Step {i + 1} / {NUM_EPOCHS} with {ITEM_PER_EPOCH} keys: {ITEM_PER_EPOCH / (time.time() - s):.0f} keys/s"
+        )
+
+
+@timer
+def test_metric_scalar(mlop, run, NUM_EPOCHS=10_000, ITEM_PER_EPOCH=100):
+    data = {f"scalar/{TAG}-{j}": random.random() for j in range(ITEM_PER_EPOCH)}
+    s = time.time()
+    for i in range(NUM_EPOCHS):
+        run._log(data, step=None)  # bypass queue
+    print(
+        f"{TAG}: {NUM_EPOCHS} calls with {ITEM_PER_EPOCH} scalars: {NUM_EPOCHS / (time.time() - s):.0f} calls/s"
+    )
+
+
+@timer
+def test_metric_tensor(mlop, run, NUM_EPOCHS=1_000, ITEM_PER_EPOCH=10):
+    import torch
+
+    n = {"transfers": 0}
+    cpu, item = torch.Tensor.cpu, torch.Tensor.item
+
+    def count(f):
+        def wrapper(*args, **kwargs):
+            n["transfers"] += 1
+            return f(*args, **kwargs)
+
+        return wrapper
+
+    torch.Tensor.cpu, torch.Tensor.item = count(cpu), count(item)
+    try:
+        for i in range(NUM_EPOCHS):
+            run.log(
+                {f"tensor/{TAG}-{j}": torch.rand(()) for j in range(ITEM_PER_EPOCH)}
+            )
+        wait(run)
+        time.sleep(0.1)  # let the worker finish the last batch
+    finally:
+        torch.Tensor.cpu, torch.Tensor.item = cpu, item
+    print(
+        f"{TAG}: {n['transfers'] / NUM_EPOCHS:.2f} transfers/step for {ITEM_PER_EPOCH} tensors/step"
+    )
+    values = torch.rand(NUM_EPOCHS, dtype=torch.bfloat16)  # mixed precision
+    run.log_batch(f"tensor/{TAG}-bf16", values=values)
+
+
+@timer
+def test_metric_commit(mlop, run, NUM_EPOCHS=1_000, ITEM_PER_EPOCH=10):
+    store = {"insert": 0}
+    if run._store:
+        insert = run._store.insert
+
+        def count(*args, **kwargs):
+            store["insert"] += 1
+            return insert(*args, **kwargs)
+
+        run._store.insert = count
+
+    for commit in [None, False]:
+        wait(run)
+        total, store["insert"] = run._iface._total if run._iface else 0, 0
+        base = run._step
+        for i in range(NUM_EPOCHS):
+            step = base + 2 * i + 1
+            # lightning: loss, lr monitor and throughput callbacks at the same step
+            run.log({f"lightning/{TAG}-loss": random.random()}, step, commit)
+            run.log({f"lightning/{TAG}-lr": 1e-3}, step, commit)
+            run.log({f"lightning/{TAG}-throughput": 1e3}, step, commit)
+            # transformers: per-layer histogram hooks followed by on_log
+            for j in range(ITEM_PER_EPOCH):
+                run.log(
+                    {f"grad/{TAG}-{j}": mlop.Histogram([random.random()] * 8)},
+                    step=step + 1,
+                    commit=commit,
+                )
+            run.log({f"transformers/{TAG}-loss": random.random()}, step + 1)
+        wait(run)
+        time.sleep(0.1)  # let the worker finish the last batch
+        print(
+            f"{TAG}: commit={commit}: {(run._iface._total if run._iface else 0) - total} lines published, {store['insert']} store inserts for {NUM_EPOCHS * 2} steps"
+        )
+
+
+@timer
+def test_metric_reduce(mlop, run, NUM_EPOCHS=10_000, ITEM_PER_EPOCH=100):
+    pub = {"points": 0}
+    if run._iface:
+        publish, publish_batch = run._iface.publish, run._iface.publish_batch
+
+        def count(num=None, **kwargs):
+            pub["points"] += len(num or {})
+            return publish(num=num, **kwargs)
+
+        def count_batch(keys, steps, values, timestamps):
+            pub["points"] += values.size
+            return publish_batch(keys, steps, values, timestamps)
+
+        run._iface.publish, run._iface.publish_batch = count, count_batch
+
+    run.settings.reduce = {
+        f"reduce/{TAG}-0": "last+min+max:100",
+        "reduce/*": "mean:100",
+    }
+    try:
+        keys = [f"reduce/{TAG}-{j}" for j in range(ITEM_PER_EPOCH)]
+        s = time.time()
+        for i in range(NUM_EPOCHS):
+            run._log({k: random.random() for k in keys}, step=None)  # bypass queue
+        loop = NUM_EPOCHS / (time.time() - s)
+        print(
+            f"{TAG}: log: {NUM_EPOCHS * ITEM_PER_EPOCH} points reduced to {pub['points']} published at {loop:.0f} steps/s"
+        )
+
+        pub["points"] = 0
+        s = time.time()
+        run._log_batch(
+            keys, None, np.random.rand(NUM_EPOCHS, ITEM_PER_EPOCH), None
+        )  # bypass queue
+        batch = NUM_EPOCHS / (time.time() - s)
+        print(
+            f"{TAG}: log_batch: {NUM_EPOCHS * ITEM_PER_EPOCH} points reduced to {pub['points']} published at {batch:.0f} steps/s"
+        )
+    finally:
+        run.settings.reduce = {}
+        if run._iface:
+            run._iface.publish, run._iface.publish_batch = publish, publish_batch
+
+
 if __name__ == "__main__":
     mlop, run = init_test(TAG)
     test_metric(mlop, run)
+    test_metric_batch(mlop, run)
+    test_metric_keys(mlop, run)
+    test_metric_scalar(mlop, run)
+    test_metric_tensor(mlop, run)
+    test_metric_commit(mlop, run)
+    test_metric_reduce(mlop, run)
@@ -0,0 +1,143 @@
+# local stand-in for the api, ingest and py servers; decompresses request bodies
+import gzip
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import keyring
+import keyring.backends.null
+
+# the stand-in accepts any key; keep runs against it out of the developer's keyring
+os.environ["PYTHON_KEYRING_BACKEND"] = "keyring.backends.null.Keyring"
+keyring.set_keyring(keyring.backends.null.Keyring())  # if already initialised
+
+PORTS = {"api": 3001, "ingest": 3003, "py": 3004}
+STATS = {
+    "requests": {},
+    "lines": {},
+    "bytes": {},
+    "raw": {},
+    "connections": {},
+    "parts": {},
+    "urls": {},  # storage path -> puts it received
+}
+LOCK = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with LOCK:
+            p = self.server.server_address[1]
+            STATS["connections"][p] = STATS["connections"].get(p, 0) + 1
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            b = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                b += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            b = self.rfile.read(n)
+        raw = len(b)
+        enc = self.headers.get("Content-Encoding")
+        if enc == "gzip":
+            b = gzip.decompress(b)
+        elif enc == "zstd":
+            import zstandard
+
+            b = zstandard.ZstdDecompressor().decompress(b)
+        with LOCK:
+            p = self.path.split("?")[0]
+            STATS["requests"][p] = STATS["requests"].get(p, 0) + 1
+            STATS["bytes"][p] = STATS["bytes"].get(p, 0) + len(b)
+            STATS["raw"][p] = STATS["raw"].get(p, 0) + raw
+            if p.startswith("/ingest"):
+                STATS["lines"][p] = STATS["lines"].get(p, 0) + len(b.splitlines())
+        return b
+
+    def _send(self, d, code=200):
+        b = json.dumps(d).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def do_PUT(self):  # discard while reading so large uploads stay out of memory
+        p = self.path.split("?")[0]
+        n = size = int(self.headers.get("Content-Length") or 0)
+        while n > 0:
+            b = self.rfile.read(min(n, 2**20))
+            if not b:
+                break
+            n -= len(b)
+        with LOCK:
+            STATS["requests"][p] = STATS["requests"].get(p, 0) + 1
+            STATS["bytes"][p] = STATS["bytes"].get(p, 0) + size - n
+            if p in STATS["urls"]:
+                STATS["urls"][p] += 1
+            if self.headers.get("Content-Range"):
+                STATS["parts"][p] = STATS["parts"].get(p, 0) + 1
+        self._send({})
+
+    def do_POST(self):
+        b = self._body()
+        p = self.path.split("?")[0]
+        if p == "/api/slug":
+            self._send({"organization": {"slug": "local"}})
+        elif p == "/api/runs/create":
+            self._send({"url": "http://localhost:3000/run", "runId": 1})
+        elif p == "/api/runs/trigger":
+            self._send({"status": "RUNNING"})
+        elif p == "/files":
+            r = {}
+            for f in json.loads(b)["files"]:
+                n = f["fileName"]  # one url per step, as names repeat across steps
+                p = f"/storage/{f['step']}/{n}"
+                r.setdefault(f["logName"], []).append({n: f"http://localhost:3003{p}"})
+                with LOCK:
+                    STATS["urls"].setdefault(p, 0)
+            self._send(r)
+        else:
+            self._send({})
+
+
+def serve():
+    for port in PORTS.values():
+        s = ThreadingHTTPServer(("localhost", port), Handler)
+        threading.Thread(target=s.serve_forever, daemon=True).start()
+    return STATS
+
+
+def spawn():
+    # run out of process so the client under test is measured alone
+    p = subprocess.Popen([sys.executable, os.path.abspath(__file__)])
+    for port in PORTS.values():
+        while True:
+            try:
+                socket.create_connection(("localhost", port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+    return p
+
+
+if __name__ == "__main__":
+    serve()
+    threading.Event().wait()
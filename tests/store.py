@@ -0,0 +1,173 @@
+import os
+import random
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+
+from .args import timer
+
+TAG = "store"
+
+
+def get_settings(mlop, name):
+    settings = mlop.Settings()
+    settings.update({"dir": ".mlop", "project": "test-" + TAG, "_op_name": name})
+    os.makedirs(settings.get_dir(), exist_ok=True)
+    return settings
+
+
+def get_v1(path, NUM_POINTS, NUM_KEYS):
+    # the layout before schema versioning: full key per row, no index
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE num(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time INTEGER NOT NULL,
+            step INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value REAL NOT NULL
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE file(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time INTEGER NOT NULL,
+            step INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            aid REAL NOT NULL
+        );
+    """)
+    t = time.time()
+    conn.executemany(
+        "INSERT INTO num (time, step, key, value) VALUES (?, ?, ?, ?)",
+        (
+            (t, i // NUM_KEYS, f"{TAG}/metric-{i % NUM_KEYS}", random.random())
+            for i in range(NUM_POINTS)
+        ),
+    )
+    conn.commit()
+    return conn
+
+
+@timer
+def test_store_schema(
+    mlop, NUM_POINTS=100_000_000, NUM_KEYS=100, NUM_QUERIES=10_000, NUM_V1=1_000_000
+):
+    from mlop.store import DataStore
+
+    keys = [f"{TAG}/metric-{j}" for j in range(NUM_KEYS)]
+    steps = NUM_POINTS // NUM_KEYS
+    chunk = 2**14 // NUM_KEYS
+
+    settings = get_settings(mlop, "v2")
+    store = DataStore(config=None, settings=settings)
+    s = time.time()
+    for i in range(0, steps, chunk):
+        n = min(chunk, steps - i)
+        store.insert_batch(
+            keys,
+            np.arange(i, i + n),
+            np.random.rand(n, NUM_KEYS),
+            np.full(n, time.time()),
+        )
+    store.stop()
+    e = time.time() - s
+    size = os.path.getsize(store.db)
+    print(
+        f"{TAG}: v2: inserted {NUM_POINTS} point(s) in {e:.2f}s ({NUM_POINTS / e:.0f} points/s), {size / 2**20:.0f} MiB ({size / NUM_POINTS:.1f} bytes/point)"
+    )
+
+    store = DataStore(config=None, settings=settings)
+    s = time.time()
+    hits = 0
+    for _ in range(NUM_QUERIES):
+        i = random.randrange(steps)
+        hits += len(store.query(random.choice(keys), i, i)) == 1
+    e = time.time() - s
+    print(
+        f"{TAG}: v2: {NUM_QUERIES} point quer(ies) in {e:.2f}s ({NUM_QUERIES / e:.0f} queries/s), {hits} hit(s)"
+    )
+    store.stop()
+    shutil.rmtree(store.settings.get_dir())
+
+    # v1 scans the whole table for every point
+    settings = get_settings(mlop, "v1")
+    path = f"{settings.get_dir()}/{settings.store_db}"
+    conn = get_v1(path, NUM_V1, NUM_KEYS)
+    q = max(1, NUM_QUERIES // 1000)
+    s = time.time()
+    for _ in range(q):
+        conn.execute(
+            "SELECT step, time, value FROM num WHERE key = ? AND step = ?",
+            (random.choice(keys), random.randrange(NUM_V1 // NUM_KEYS)),
+        ).fetchall()
+    e = time.time() - s
+    conn.close()
+    print(
+        f"{TAG}: v1: {q} point quer(ies) over {NUM_V1} point(s) in {e:.2f}s ({q / e:.1f} queries/s), {os.path.getsize(path) / NUM_V1:.1f} bytes/point"
+    )
+
+    s = time.time()
+    store = DataStore(config=None, settings=settings)  # migrates on open
+    e = time.time() - s
+    ok = len(store.query(keys[0], 0, 0)) == 1
+    size = os.path.getsize(store.db)
+    print(
+        f"{TAG}: migrated {NUM_V1} point(s) to v2 in {e:.2f}s: {'queryable' if ok else 'missing'}, {size / NUM_V1:.1f} bytes/point"
+    )
+    store.stop()
+    shutil.rmtree(store.settings.get_dir())
+
+
+def get_flushes():
+    # cache flushes completed by all block devices; fsyncs reach the disk as flushes
+    try:
+        with open("/proc/diskstats") as f:
+            return sum(
+                int(p[18])
+                for p in (line.split() for line in f)
+                if len(p) > 18 and not p[2].startswith(("loop", "ram", "dm-"))
+            )
+    except (OSError, ValueError):
+        return None
+
+
+@timer
+def test_store_writer(mlop, NUM_EPOCHS=5_000, ITEM_PER_EPOCH=1_000, BATCH=10):
+    from .server import serve
+
+    serve()
+    keys = [f"{TAG}/metric-{j}" for j in range(ITEM_PER_EPOCH)]
+    for sync in ["FULL", "NORMAL", "OFF"]:
+        settings = mlop.Settings()
+        settings.update(
+            {
+                "host": "localhost",
+                "_auth": TAG,
+                "disable_iface": True,  # measure the store alone
+                "disable_store": False,
+                "store_synchronous": sync,
+            }
+        )
+        run = mlop.init(dir=".mlop", project="test-" + TAG, settings=settings)
+        flushes = get_flushes()
+        s = time.time()
+        for i in range(0, NUM_EPOCHS, BATCH):
+            run.log_batch(keys, values=np.random.rand(BATCH, ITEM_PER_EPOCH))
+        run.finish()
+        e = time.time() - s
+        flushes = get_flushes() - flushes if flushes is not None else None
+        rows = NUM_EPOCHS * ITEM_PER_EPOCH
+        print(
+            f"{TAG}: synchronous={sync}: {rows} row(s) in {e:.2f}s ({rows / e:.0f} rows/s), {run._store._commits} commit(s), {flushes} flush(es) ({(flushes or 0) / e:.1f}/s)"
+        )
+        shutil.rmtree(run.settings.get_dir())
+
+
+if __name__ == "__main__":
+    import mlop
+
+    test_store_schema(mlop)
+    test_store_writer(mlop)
@@ -62,6 +62,49 @@ def test_video(
         time.sleep(WAIT)
 
 
+@timer
+def test_video_stream(mlop, run, NUM_EPOCHS=300, SIZE=(3, 240, 320)):
+    import threading
+
+    import psutil
+
+    p, rss, done = psutil.Process(), [], threading.Event()
+
+    def sample():
+        while not done.is_set():
+            rss.append(p.memory_info().rss)
+            time.sleep(0.01)
+
+    t = threading.Thread(target=sample, daemon=True)
+    t.start()
+    data = np.random.randint(0, 256, size=(NUM_EPOCHS, *SIZE), dtype=np.uint8)
+    base, s = p.memory_info().rss, time.time()
+    rss.clear()
+    video = mlop.Video(data, caption=f"{TAG}-array", fps=30)
+    run.log({f"{TAG}/array": video})
+    while video._path is None:  # encoded in the background
+        time.sleep(0.01)
+    print(
+        f"{TAG}: array of {data.nbytes / 2**20:.0f} MiB in {time.time() - s:.2f}s: peak rss {(max(rss) - base) / 2**20:+.0f} MiB"
+    )
+    del data
+
+    base, s = p.memory_info().rss, time.time()
+    rss.clear()
+    video = mlop.Video(caption=f"{TAG}-rollout", fps=30)
+    for i in range(NUM_EPOCHS):
+        video.append_frame(np.random.randint(0, 256, size=SIZE, dtype=np.uint8))
+    run.log({f"{TAG}/rollout": video})
+    while video._path is None:
+        time.sleep(0.01)
+    done.set()
+    t.join()
+    print(
+        f"{TAG}: {NUM_EPOCHS} appended frame(s) in {time.time() - s:.2f}s: peak rss {(max(rss) - base) / 2**20:+.0f} MiB"
+    )
+
+
 if __name__ == "__main__":
     mlop, run = init_test(TAG)
     test_video(mlop, run)
+    test_video_stream(mlop, run)